@@ -0,0 +1,359 @@
+"""Generate synthetic Laravel-style projects and benchmark php-inspect on them.
+
+    python3 php-inspect-bench.py generate /tmp/project --classes 1000
+    python3 php-inspect-bench.py run --sizes 1000 10000 --output bench.json
+    python3 php-inspect-bench.py run --baseline bench-baseline.json --threshold 0.2
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+GROUPS = {
+    "Models": "Model",
+    "Services": "Service",
+    "Repositories": "Repository",
+    "Http\\Controllers": "Controller",
+    "Jobs": "Job",
+    "Support": "Helper",
+}
+
+METHODS = [
+    "get",
+    "handle",
+    "process",
+    "build",
+    "findAll",
+    "compute",
+    "render",
+    "toArray",
+    "sync",
+    "scopeActive",
+]
+
+MARKER = ".php-inspect-bench"  # written in generated projects, which can be replaced
+
+PHASES = [
+    "init",
+    "load",
+    "scan",
+    "write_output",
+    "print_invalid_branches",
+    "print_unused_functions",
+    "print_specific",
+]
+
+
+def load_inspect():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "php-inspect.py")
+    spec = importlib.util.spec_from_file_location("php_inspect", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate(
+    path,
+    classes=1000,
+    fanout=4,
+    depth=3,
+    cycles=0.05,
+    aliases=0.1,
+    traits=0.05,
+    entrypoints=20,
+    seed=0,
+):
+    """Write a fake project under `path` (app/, routes/, config/ and a
+    config.ini) and return the FQCNs of its classes.
+
+    Class i only imports classes declared before it, except for a `cycles`
+    share of imports pointing forward, which closes caller cycles. A
+    non-empty `path` is only replaced when it holds the MARKER file of a
+    previous run.
+    """
+    rng = random.Random(seed)
+    if os.path.isdir(path) and os.listdir(path):
+        if not os.path.exists(os.path.join(path, MARKER)):
+            sys.exit(f"{path} is not empty and was not generated, not replacing it")
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, MARKER), mode="w"):
+        pass
+
+    decls = []
+    for i in range(classes):
+        if rng.random() < traits:
+            group, prefix, kind = "Traits", "Has", "trait"
+        else:
+            group, prefix = rng.choice(list(GROUPS.items()))
+            kind = "class"
+        decls += [(group, f"{prefix}{i}", kind)]
+    fqcns = [f"App\\{group}\\{name}" for group, name, _ in decls]
+    # "method{i}End" is never part of another name, unlike "method1" of "method10"
+    methods = [
+        rng.sample(METHODS, rng.randint(1, 4)) + [f"method{i}End"]
+        for i in range(classes)
+    ]
+    levels = [0] * classes
+
+    for i, (group, name, kind) in enumerate(decls):
+        parent = None
+        if kind == "class" and i > 0 and rng.random() < 0.3:
+            candidates = [
+                j
+                for j in rng.sample(range(i), min(i, 8))
+                if decls[j][2] == "class" and levels[j] < depth
+            ]
+            if candidates:
+                parent = candidates[0]
+                levels[i] = levels[parent] + 1
+
+        targets = []
+        for _ in range(rng.randint(0, fanout)):
+            if i + 1 < classes and rng.random() < cycles:
+                j = rng.randrange(i + 1, classes)
+            elif i > 0:
+                j = rng.randrange(i)
+            else:
+                continue
+            if decls[j][2] == "class" and j not in targets and j != parent:
+                targets += [j]
+        used_traits = [
+            j
+            for j in rng.sample(range(classes), min(classes, 2))
+            if decls[j][2] == "trait"
+        ]
+
+        lines = ["<?php", "", f"namespace App\\{group};", ""]
+        refs = []
+        for j in targets:
+            if rng.random() < aliases:
+                alias = f"{decls[j][1]}Alias"
+                lines += [f"use {fqcns[j]} as {alias};"]
+            else:
+                alias = decls[j][1]
+                lines += [f"use {fqcns[j]};"]
+            refs += [(alias, j)]
+        if parent is not None:
+            lines += [f"use {fqcns[parent]};"]
+        for j in used_traits:
+            lines += [f"use {fqcns[j]};"]
+        lines += ["use Illuminate\\Support\\Str;", ""]
+        if rng.random() < 0.05:
+            lines += ["/**", " * @deprecated", " */"]
+        extends = f" extends {decls[parent][1]}" if parent is not None else ""
+        lines += [f"{kind} {name}{extends}", "{"]
+        for j in used_traits:
+            lines += [f"    use {decls[j][1]};", ""]
+        for method in methods[i]:
+            visibility = rng.choice(["public", "public", "protected", "private"])
+            lines += [
+                "    /**",
+                "     * Documentation, without the name which would call it.",
+                "     */",
+                f"    {visibility} function {method}($value)",
+                "    {",
+            ]
+            for alias, j in rng.sample(refs, min(len(refs), 2)):
+                lines += [
+                    f"        $other = new {alias}();",
+                    f"        $other->{rng.choice(methods[j])}($value);",
+                ]
+            if rng.random() < 0.5:
+                lines += [f"        return $this->{rng.choice(methods[i])}($value);"]
+            lines += ["    }", ""]
+        lines += ["}", ""]
+
+        filename = os.path.join(path, "app", *group.split("\\"), f"{name}.php")
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, mode="w") as f:
+            f.write("\n".join(lines))
+
+    controllers = [i for i, decl in enumerate(decls) if decl[0] == "Http\\Controllers"]
+    others = [i for i, decl in enumerate(decls) if decl[2] == "class"]
+    for n in range(entrypoints):
+        folder = "routes" if n % 2 == 0 else "config"
+        picks = rng.sample(controllers or others, min(len(controllers or others), 5))
+        lines = ["<?php", ""] + [f"use {fqcns[j]};" for j in picks] + [""]
+        lines += [
+            f"Route::get('/{decls[j][1].lower()}', [{decls[j][1]}::class, 'handle']);"
+            for j in picks
+        ]
+        if folder == "config" and others:
+            lines += [f"return ['{fqcns[rng.choice(others)]}'];"]
+        filename = os.path.join(path, folder, f"file{n}.php")
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, mode="w") as f:
+            f.write("\n".join(lines))
+
+    to_scan = "\n".join(f"    {fqcn}" for fqcn in fqcns[:: max(1, classes // 3)])
+    with open(os.path.join(path, "config.ini"), mode="w") as f:
+        f.write(
+            f"""[input]
+root_path   = {os.path.join(path, "app")}
+entrypoints =
+    ../routes
+    ../config
+ignored     =
+ignored_func =
+ignored_func_names =
+
+[output]
+output_file      = unused.txt
+print_invalid    = true
+print_functions  = true
+print_specific   = true
+print_deprecated = true
+to_scan          =
+{to_scan}
+remove_files     = false
+remove_func      = false
+"""
+        )
+    return fqcns
+
+
+def bench(inspect, path, fqcns, workers=1):
+    """Time every phase of a run on a generated project, in seconds"""
+    inspect.File.ignored = []
+    inspect.File.ignored_func = []
+    inspect.Function.ignored_func_names = []
+    db = inspect.DB(os.path.join(path, "app"), ["../routes", "../config"], workers)
+    to_scan = fqcns[:: max(1, len(fqcns) // 3)]
+    steps = [
+        ("init", db.init),
+        ("load", db.load),
+        ("scan", db.scan),
+        (
+            "write_output",
+            lambda: inspect.write_output(db, os.path.join(path, "unused.txt")),
+        ),
+        ("print_invalid_branches", lambda: inspect.print_invalid_branches(db, True)),
+        ("print_unused_functions", lambda: inspect.print_unused_functions(db, True)),
+        ("print_specific", lambda: inspect.print_specific(db, to_scan)),
+    ]
+    times = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, step in steps:
+            t0 = perf_counter()
+            step()
+            times[name] = perf_counter() - t0
+    return times
+
+
+def compare(results, baseline, threshold, min_delta):
+    """-> list of (size, phase, baseline, current) regressions"""
+    regressions = []
+    for size, times in results["sizes"].items():
+        for phase, seconds in times.items():
+            previous = baseline.get("sizes", {}).get(size, {}).get(phase)
+            if (
+                previous is not None
+                and seconds > previous * (1 + threshold)
+                and seconds - previous > min_delta
+            ):
+                regressions += [(size, phase, previous, seconds)]
+    return regressions
+
+
+def run(args):
+    inspect = load_inspect()
+    results = {
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "workers": args.workers,
+        "sizes": {},
+    }
+    workdir = args.workdir or tempfile.mkdtemp(prefix="php-inspect-bench-")
+    try:
+        for size in args.sizes:
+            path = os.path.join(workdir, f"project-{size}")
+            fqcns = generate(path, classes=size, seed=args.seed)
+            times = bench(inspect, path, fqcns, args.workers)
+            results["sizes"][str(size)] = times
+            print(
+                f"{size} classes: "
+                + ", ".join(f"{name} {1000 * times[name]:.1f}ms" for name in PHASES)
+            )
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, mode="w") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote results in {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+        for size, phase, previous, seconds in regressions:
+            print(
+                f"regression: {phase} on {size} classes "
+                f"{1000 * previous:.1f}ms -> {1000 * seconds:.1f}ms"
+            )
+        if regressions:
+            sys.exit(1)
+        print(f"no regression over {args.threshold:.0%} against {args.baseline}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="write a synthetic project")
+    gen.add_argument("path")
+    gen.add_argument("--classes", type=int, default=1000)
+    gen.add_argument("--fanout", type=int, default=4, help="max imports per class")
+    gen.add_argument("--depth", type=int, default=3, help="max inheritance depth")
+    gen.add_argument("--cycles", type=float, default=0.05, help="forward import share")
+    gen.add_argument("--aliases", type=float, default=0.1, help="aliased import share")
+    gen.add_argument("--traits", type=float, default=0.05, help="trait share")
+    gen.add_argument("--entrypoints", type=int, default=20)
+    gen.add_argument("--seed", type=int, default=0)
+
+    bench_parser = commands.add_parser("run", help="benchmark generated projects")
+    bench_parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000, 50000]
+    )
+    bench_parser.add_argument("--seed", type=int, default=0)
+    bench_parser.add_argument("--workers", type=int, default=1)
+    bench_parser.add_argument("--workdir", help="keep generated projects there")
+    bench_parser.add_argument("--output", help="write results as JSON")
+    bench_parser.add_argument("--baseline", help="results to compare against")
+    bench_parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed slowdown (0.2 = 20%%)"
+    )
+    bench_parser.add_argument(
+        "--min-delta", type=float, default=0.005, help="ignore smaller slowdowns (s)"
+    )
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        fqcns = generate(
+            args.path,
+            classes=args.classes,
+            fanout=args.fanout,
+            depth=args.depth,
+            cycles=args.cycles,
+            aliases=args.aliases,
+            traits=args.traits,
+            entrypoints=args.entrypoints,
+            seed=args.seed,
+        )
+        print(f"generated {len(fqcns)} classes in {args.path}")
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
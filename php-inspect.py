@@ -1,8 +1,30 @@
+import cProfile
+import difflib
+import hashlib
+import json
+import mmap
 import os
+import pickle
 import re
-from time import time
+import subprocess
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
+from fnmatch import fnmatch
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from time import perf_counter, sleep, time
+from urllib.parse import parse_qs, urlsplit
 from configparser import ConfigParser
 
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
 COLORS = [
     "087",  # #5fffff
     "085",  # #5fffaf
@@ -41,13 +63,20 @@ KEYWORDS = [
 ]
 
 
+plain = False  # no colors, from [output] color
+
+
 def colorize(text, color=None):
+    if plain:
+        return str(text)
     if color is None:
         return auto_colorize(str(text))
     return f"\033[38;5;{color}m{str(text)}\033[0m"
 
 
 def colorize_namespace(ns):
+    if plain:
+        return ns
     return "\\".join(
         colorize(fragment, COLORS[i % len(COLORS)])
         for i, fragment in enumerate(ns.split("\\"))
@@ -69,78 +98,1210 @@ def auto_colorize(text):
         return text
 
 
-def dir_walk(*paths, file_filter=None):
-    if len(paths) != 1:
-        return [os.path.join(path, item) for path in paths for item in dir_walk(path)]
-    path = paths[0]
-    dir_items = []
-    items = []
-    for item in sorted(os.listdir(path)):
-        subpath = os.path.join(path, item)
-        if os.path.isfile(subpath):
-            if file_filter is None or re.match(file_filter, item):
-                items += [subpath]
+def dir_walk(*paths, file_filter=None, exclude=()):
+    """Yield the files under `paths`, each directory in name order with its
+    sub-directories first; entries matching an `exclude` glob (on their
+    name or their path relative to the walked root) are skipped."""
+    pattern = re.compile(file_filter) if file_filter is not None else None
+
+    def excluded(entry, root):
+        if not exclude:
+            return False
+        relpath = os.path.relpath(entry.path, root).replace(os.sep, "/")
+        return any(
+            fnmatch(entry.name, glob) or fnmatch(relpath, glob) for glob in exclude
+        )
+
+    def scan(path, root):
+        dirs = []
+        files = []
+        with os.scandir(path) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.name):
+                if excluded(entry, root):
+                    continue
+                if entry.is_file():
+                    profiler.count("regex")
+                    if pattern is None or pattern.match(entry.name):
+                        files += [entry.path]
+                elif entry.is_dir():
+                    dirs += [entry.path]
+        return iter(dirs), files
+
+    for root in paths:
+        stack = [scan(root, root)]
+        while stack:
+            dirs, files = stack[-1]
+            path = next(dirs, None)
+            if path is None:
+                stack.pop()
+                yield from files
+            else:
+                stack += [scan(path, root)]
+
+
+TOKEN = re.compile(
+    rb"""
+    \s+
+    | (?P<doc>/\*\*.*?\*/)
+    | /\*.*?\*/
+    | (?://|\#(?!\[))[^\n]*
+    | (?P<open><\?(?:php|=)?)
+    | \?>.*?(?=<\?) | \?>.*
+    | (?P<heredoc><<<[ \t]*(?P<quote>["']?)(?P<tag>[\w\x80-\xff]+)(?P=quote)[ \t]*\r?\n
+        .*?^[ \t]*(?P=tag)\b)
+    | (?P<string>'(?:[^'\\]|\\.)*' | "(?:[^"\\]|\\.)*" | `(?:[^`\\]|\\.)*`)
+    | (?P<var>\$[\w\x80-\xff]+)
+    | (?P<name>\\?[\w\x80-\xff]+(?:\\[\w\x80-\xff]+)*\\?)
+    | (?P<op>\?->|->|::|\#\[)
+    | (?P<char>.)
+    """,
+    re.S | re.M | re.X,
+)
+IMPORT = re.compile(r"App\\[\\\w]+")
+REFERENCE = re.compile(rb"[\w\x80-\xff]+(?:\\{1,2}[\w\x80-\xff]+)+")
+NEWLINE = re.compile(rb"\n")
+CALLABLE = re.compile(  # "method" or "Class@method" in a string
+    rb"(?:(?P<class>\\{0,2}[\w\x80-\xff]+(?:\\{1,2}[\w\x80-\xff]+)*)@)?"
+    rb"(?P<name>[a-zA-Z_\x80-\xff][\w\x80-\xff]*)"
+)
+MODIFIERS = {
+    b"abstract",
+    b"final",
+    b"private",
+    b"protected",
+    b"public",
+    b"readonly",
+    b"static",
+}
+VISIBILITIES = {b"private", b"protected", b"public"}
+STATEMENT_ENDS = {None, b";", b"{", b"}", b"<?php", b"<?", b"<?="}
+
+
+def decode(data):
+    return data.decode("utf-8", "surrogateescape")
+
+
+def tokenize(content):
+    """Yield (kind, text, offset) for each significant PHP token, as bytes.
+
+    Whitespace, comments and inline HTML are skipped, strings and heredocs
+    come out as single tokens so their content is never mistaken for code.
+    Names are PHP names, bytes over 0x7f included.
+    """
+    for match in TOKEN.finditer(content):
+        if match.lastgroup is not None:
+            yield match.lastgroup, match.group(), match.start()
+
+
+class LineCounter:
+    """Line of an offset in bytes or a mmap (which has no `count`)"""
+
+    def __init__(self, content):
+        self.content = content
+        self.pos = 0
+        self.line = 0
+
+    def __call__(self, pos):
+        if pos >= self.pos:
+            self.line += len(NEWLINE.findall(self.content, self.pos, pos))
         else:
-            dir_items += [
-                os.path.join(subpath, subitem)
-                for subitem in dir_walk(subpath, file_filter=file_filter)
-            ]
-    return dir_items + items
+            self.line -= len(NEWLINE.findall(self.content, pos, self.pos))
+        self.pos = pos
+        return self.line
+
+
+def closure(item, neighbours):
+    found = set()
+    queue = [item]
+    for current in queue:
+        for other in neighbours(current):
+            if other not in found and other is not item:
+                found.add(other)
+                queue += [other]
+    return found
+
+
+IDENTIFIER = re.compile(rb"[\w\x80-\xff]+")
+
+
+class Matcher:
+    """Aho-Corasick automaton over a set of patterns.
+
+    `count` returns non-overlapping occurrences per pattern, the same way
+    `str.count` does for each pattern taken alone.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for pattern in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto[state][char] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = self.goto[state][char]
+            self.out[state] = (pattern,)
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.out[next_state] += self.out[self.fail[next_state]]
+                queue.append(next_state)
+
+    def count(self, text):
+        goto, fail, out = self.goto, self.fail, self.out
+        counts = {}
+        ends = {}
+        state = 0
+        for pos, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern in out[state]:
+                if pos - len(pattern) >= ends.get(pattern, 0):
+                    counts[pattern] = counts.get(pattern, 0) + 1
+                    ends[pattern] = pos
+        return counts
+
+
+class Index:
+    """Inverted identifier index of the loaded files.
+
+    Patterns made of word characters cannot straddle two identifiers, so
+    their occurrences in a file are the sum of their occurrences in each of
+    its identifiers: the vocabulary is matched once instead of every file.
+
+    Files added after names were resolved are matched against all of them
+    at once, so a watched file can be updated without resolving again.
+    """
+
+    def __init__(self):
+        self.tokens = {}
+        self.mentions = {}
+        self.matcher = None
+
+    def add(self, file, counts):
+        for token, count in counts.items():
+            files = self.tokens.get(token)
+            if files is None:
+                self.tokens[token] = {file: count}
+            else:
+                files[file] = count
+        if self.mentions:
+            if self.matcher is None:
+                self.matcher = Matcher(self.mentions)
+            for token, count in counts.items():
+                for name, occurrences in self.matcher.count(token).items():
+                    mentions = self.mentions[name]
+                    mentions[file] = mentions.get(file, 0) + occurrences * count
+
+    def remove(self, file):
+        for files in self.tokens.values():
+            files.pop(file, None)
+        for mentions in self.mentions.values():
+            mentions.pop(file, None)
+
+    def resolve(self, names):
+        names = {name for name in names if name not in self.mentions}
+        if not names:
+            return
+        self.matcher = None
+        for name in names:
+            self.mentions[name] = {}
+        matcher = Matcher(names)
+        for token, files in self.tokens.items():
+            for name, occurrences in matcher.count(token).items():
+                mentions = self.mentions[name]
+                for file, count in files.items():
+                    mentions[file] = mentions.get(file, 0) + occurrences * count
+
+    def get(self, name):
+        if name not in self.mentions:
+            self.resolve([name])
+        return self.mentions[name]
+
+    def files(self, *names):
+        files = {file for name in names for file in self.get(name)}
+        return sorted(files, key=lambda file: file.id)
+
+    def count(self, file, name):
+        return self.get(name).get(file, 0)
+
+
+class Cache:
+    """On-disk parse results, keyed by real path and entrypoint flag (which
+    changes the parse) and checked against the mtime and size of the file
+    (and its content hash if `check_hash`).
+
+    Bump VERSION whenever the layout of `File.dump` changes.
+    """
+
+    VERSION = 7
+    shared = None  # entries of the batch cache in its workers, saved by the parent
+
+    def __init__(self, path, check_hash=False):
+        self.path = path
+        self.check_hash = check_hash
+        self.entries = {}
+        self.seen = set()
+        self.hits = 0
+        self.changed = False
+        self.added = {}
+
+    @staticmethod
+    def init_worker(entries):
+        Cache.shared = entries
 
+    def load(self):
+        if Cache.shared is not None:
+            self.entries = Cache.shared
+            return
+        try:
+            with open(self.path, mode="rb") as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return
+        if isinstance(data, dict) and data.get("version") == Cache.VERSION:
+            self.entries = data["entries"]
+        else:
+            self.changed = True
+
+    @staticmethod
+    def digest(path):
+        with open(path, mode="rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def stamp(self, path):
+        stat = os.stat(path)
+        digest = Cache.digest(path) if self.check_hash else None
+        return stat.st_mtime_ns, stat.st_size, digest
+
+    def get(self, filename, is_entrypoint):
+        """-> (stamp, cached result or None), the stamp to `put` a new result
+        with, so the file is hashed once"""
+        path = os.path.realpath(filename)
+        key = (path, is_entrypoint)
+        self.seen.add(key)
+        stamp = self.stamp(path)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            self.hits += 1
+            return stamp, entry[1]
+        return stamp, None
+
+    def put(self, filename, is_entrypoint, stamp, result):
+        key = (os.path.realpath(filename), is_entrypoint)
+        self.entries[key] = self.added[key] = (stamp, result)
+        self.changed = True
+
+    def merge(self, added):
+        self.entries.update(added)
+        self.changed = self.changed or bool(added)
+
+    def save(self):
+        if Cache.shared is not None:
+            return
+        for key in list(self.entries):
+            if key not in self.seen and not os.path.exists(key[0]):
+                del self.entries[key]
+                self.changed = True
+        if not self.changed:
+            return
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(fd, mode="wb") as f:
+            pickle.dump(
+                {"version": Cache.VERSION, "entries": self.entries},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp, self.path)
+        self.changed = False
+
+
+class Snapshot:
+    """The resolved graph in one binary file, read back without the PHP tree.
+
+    A magic, the byte size of each section, then the sections: a string
+    table, int32 records of files and functions (strings as indexes into
+    the table, -1 for None), and CSR adjacency (offsets then ids) for the
+    functions of each file and the callers and callees of files and
+    functions. Sections are read through memoryviews over a mmap, so ids
+    arrays are never copied. Ints are in native byte order, recorded in
+    the magic.
+    """
+
+    MAGIC = b"PHPINS" + (b"<3" if sys.byteorder == "little" else b">3")
+    SECTIONS = [
+        "strings",
+        "string_ends",
+        "files",
+        "file_functions",
+        "file_callers",
+        "file_caller_ids",
+        "file_called",
+        "file_called_ids",
+        "functions",
+        "function_callers",
+        "function_caller_ids",
+        "reached_by",
+        "unreached",
+        "meta",
+    ]
+    FILE_FIELDS = 9
+    FUNCTION_FIELDS = 6
+
+    @staticmethod
+    def write(db, filename):
+        strings = {}
+
+        def sid(text):
+            return -1 if text is None else strings.setdefault(text, len(strings))
+
+        def number(value):
+            return -1 if value is None else value
+
+        def flags(*values):
+            return sum(1 << i for i, value in enumerate(values) if value)
+
+        sections = {name: array("i") for name in Snapshot.SECTIONS}
+        for name in (
+            "file_functions",
+            "file_callers",
+            "file_called",
+            "function_callers",
+        ):
+            sections[name].append(0)
+        for file in db.files:
+            sections["files"].extend(
+                [
+                    sid(file.filename),
+                    sid(file.classname),
+                    sid(file.namespace),
+                    sid(file.full_classname),
+                    sid(file.type),
+                    sid(file.parent),
+                    flags(
+                        file.is_entrypoint,
+                        file.deprecated,
+                        file.used,
+                        file.reflexive_call,
+                    ),
+                    number(file.class_start_line),
+                    number(file.class_comment_lines),
+                ]
+            )
+            for func in file.functions:
+                sections["functions"].extend(
+                    [
+                        sid(func.name),
+                        sid(func.type),
+                        func.start_line,
+                        func.end_line,
+                        func.comment_lines,
+                        flags(func.deprecated, func.call_other_same),
+                    ]
+                )
+                sections["function_caller_ids"].extend(func.caller_ids)
+                sections["function_callers"].append(
+                    len(sections["function_caller_ids"])
+                )
+            sections["file_functions"].append(
+                len(sections["functions"]) // Snapshot.FUNCTION_FIELDS
+            )
+            sections["file_caller_ids"].extend(file.caller_ids)
+            sections["file_callers"].append(len(sections["file_caller_ids"]))
+            sections["file_called_ids"].extend(file.called_ids)
+            sections["file_called"].append(len(sections["file_called_ids"]))
+        sections["reached_by"].extend(db.reached_by)
+        sections["unreached"].extend(sid(filename) for filename in db.unreached)
+        sections["meta"].extend([sid(db.root_path), flags(db.imports_only)])
+
+        blob = [text.encode("utf-8", "surrogateescape") for text in strings]
+        end = 0
+        for data in blob:
+            end += len(data)
+            sections["string_ends"].append(end)
+        blob = b"".join(blob)
+        sections["strings"] = blob + b"\0" * (-len(blob) % 4)
+
+        data = [bytes(sections[name]) for name in Snapshot.SECTIONS]
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+        with os.fdopen(fd, mode="wb") as f:
+            f.write(Snapshot.MAGIC)
+            f.write(bytes(array("i", [len(section) for section in data])))
+            for section in data:
+                f.write(section)
+        os.replace(tmp, filename)
+
+    @staticmethod
+    def read(filename):
+        """-> DB with the files, functions, edges and used flags of the
+        snapshot, ready for the reports"""
+        with open(filename, mode="rb") as f:
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        if view[: len(Snapshot.MAGIC)] != Snapshot.MAGIC:
+            raise ValueError(f"not a snapshot of this platform: {filename}")
+        offset = len(Snapshot.MAGIC) + 4 * len(Snapshot.SECTIONS)
+        sizes = view[len(Snapshot.MAGIC) : offset].cast("i")
+        sections = {}
+        for name, size in zip(Snapshot.SECTIONS, sizes):
+            section = view[offset : offset + size]
+            sections[name] = section if name == "strings" else section.cast("i")
+            offset += size
+
+        blob = bytes(sections["strings"])
+        strings = []
+        start = 0
+        for end in sections["string_ends"]:
+            strings += [sys.intern(blob[start:end].decode("utf-8", "surrogateescape"))]
+            start = end
+
+        def text(i):
+            return None if i < 0 else strings[i]
+
+        meta = sections["meta"]
+        db = DB(text(meta[0]), [], imports_only=bool(meta[1] & 1))
+        files = sections["files"]
+        functions = sections["functions"]
+        file_functions = sections["file_functions"]
+        file_callers = sections["file_callers"]
+        file_caller_ids = sections["file_caller_ids"]
+        file_called = sections["file_called"]
+        file_called_ids = sections["file_called_ids"]
+        function_callers = sections["function_callers"]
+        function_caller_ids = sections["function_caller_ids"]
+        for i in range(len(file_callers) - 1):
+            record = files[Snapshot.FILE_FIELDS * i : Snapshot.FILE_FIELDS * (i + 1)]
+            file = File(text(record[0]), bool(record[6] & 1), db)
+            file.id = i
+            file.classname = text(record[1])
+            file.namespace = text(record[2])
+            file.full_classname = text(record[3])
+            file.type = text(record[4])
+            file.parent = text(record[5])
+            file.deprecated = bool(record[6] & 2)
+            file.used = bool(record[6] & 4)
+            file.reflexive_call = bool(record[6] & 8)
+            file.class_start_line = None if record[7] < 0 else record[7]
+            file.class_comment_lines = None if record[8] < 0 else record[8]
+            file.caller_ids = file_caller_ids[file_callers[i] : file_callers[i + 1]]
+            file.called_ids = file_called_ids[file_called[i] : file_called[i + 1]]
+            for j in range(file_functions[i], file_functions[i + 1]):
+                record = functions[
+                    Snapshot.FUNCTION_FIELDS * j : Snapshot.FUNCTION_FIELDS * (j + 1)
+                ]
+                func = Function.__new__(Function)
+                func.file = file
+                func.name = text(record[0])
+                func.type = text(record[1])
+                func.start_line, func.end_line, func.comment_lines = record[2:5]
+                func.deprecated = bool(record[5] & 1)
+                func.call_other_same = bool(record[5] & 2)
+                func.caller_ids = function_caller_ids[
+                    function_callers[j] : function_callers[j + 1]
+                ]
+                file.functions += [func]
+            db.files += [file]
+            if file.is_entrypoint:
+                db.entrypoints += [file.filename]
+        db.reached_by = sections["reached_by"]
+        db.unreached = [text(i) for i in sections["unreached"]]
+        db.classes = {file.full_classname: file for file in db.files if file.is_class}
+        db.split_classes()
+        db.find_unused_functions()
+        return db
+
+
+class Baseline:
+    """A scanned DB as of a git commit, pickled to be updated with the files
+    changed since that commit instead of scanning again.
+
+    Bump Cache.VERSION whenever the layout of the DB changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def fingerprint(config, imports_only):
+        """-> hash of the settings the scan depends on: [input] (ignored,
+        exclude, entrypoints, composer, call_sites...) but the worker counts"""
+        items = sorted(
+            (name, value)
+            for name, value in config.items("input")
+            if name not in ("workers", "scan_workers")
+        )
+        return hashlib.sha1(repr((items, imports_only)).encode()).hexdigest()
+
+    def load(self, commit, root_path, fingerprint):
+        """-> the DB stored for `commit`, `root_path` and the config
+        `fingerprint`, or None"""
+        try:
+            with open(self.path, mode="rb") as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError):
+            return None
+        if isinstance(data, dict) and data.get("key") == (
+            Cache.VERSION,
+            commit,
+            root_path,
+            fingerprint,
+        ):
+            return data["db"]
+        return None
+
+    def save(self, db, commit, fingerprint):
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        with os.fdopen(fd, mode="wb") as f:
+            pickle.dump(
+                {"key": (Cache.VERSION, commit, db.root_path, fingerprint), "db": db},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp, self.path)
+
+
+class Profiler:
+    """Time, call counts and counters of each phase, and the most expensive
+    items. While disabled, every hook costs a single attribute check.
 
-def backward_comment(lines, start_line):
-    comment_lines = 0
-    deprecated = False
-    if start_line > 0 and lines[start_line - 1].strip().endswith("*/"):
-        while start_line >= 0 and not lines[start_line].strip().startswith("/**"):
-            start_line -= 1
-            comment_lines += 1
-            if start_line >= 0 and "@deprecated" in lines[start_line].lower():
-                deprecated = True
-    if start_line > 0 and not lines[start_line - 1].strip():
-        start_line -= 1
-        comment_lines += 1
-    return start_line, comment_lines, deprecated
+    Phases nest: a counter is added to every phase open when it is counted.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.top = 20
+        self.reset()
+
+    def reset(self):
+        self.stack = []
+        self.phases = {}
+        self.totals = {}
+        self.items = {}
+
+    def configure(self, enabled, top=20):
+        self.enabled = enabled
+        self.top = top
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        key = "/".join([key for key, _ in self.stack] + [name])
+        phase = self.phases.setdefault(key, {"time": 0.0, "calls": 0, "counters": {}})
+        phase["calls"] += 1
+        self.stack.append((name, phase))
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            phase["time"] += perf_counter() - t0
+            phase["peak_memory"] = peak_memory()
+            self.stack.pop()
+
+    @contextmanager
+    def collect(self):
+        """Count into a fresh dict, e.g. in a worker process, to be merged
+        back into the current phases with `merge`"""
+        stack, totals = self.stack, self.totals
+        self.stack, self.totals = [], {}
+        try:
+            yield self.totals
+        finally:
+            self.stack, self.totals = stack, totals
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.totals[name] = self.totals.get(name, 0) + n
+            for _, phase in self.stack:
+                phase["counters"][name] = phase["counters"].get(name, 0) + n
+
+    def merge(self, counters):
+        for name, n in counters.items():
+            self.count(name, n)
+
+    def dump(self):
+        """-> phases, counters and items, for `add` in another process"""
+        return self.phases, self.totals, self.items
+
+    def add(self, data):
+        """Add the phases, counters and items `dump`ed by another profiler,
+        e.g. the one of a batch project"""
+        phases, totals, items = data
+        for key, other in phases.items():
+            phase = self.phases.setdefault(
+                key, {"time": 0.0, "calls": 0, "counters": {}}
+            )
+            phase["time"] += other["time"]
+            phase["calls"] += other["calls"]
+            for name, n in other["counters"].items():
+                phase["counters"][name] = phase["counters"].get(name, 0) + n
+            peaks = [phase.get("peak_memory"), other.get("peak_memory")]
+            phase["peak_memory"] = max(filter(None, peaks), default=None)
+        for name, n in totals.items():
+            self.totals[name] = self.totals.get(name, 0) + n
+        for kind, other in items.items():
+            mine = self.items.setdefault(kind, {})
+            for key, seconds in other.items():
+                mine[key] = mine.get(key, 0) + seconds
+
+    def item(self, kind, key, seconds):
+        if self.enabled:
+            items = self.items.setdefault(kind, {})
+            items[key] = items.get(key, 0) + seconds
+
+    def measure(self, kind, key, func, *args):
+        if not self.enabled:
+            return func(*args)
+        t0 = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.item(kind, key, perf_counter() - t0)
+            self.count(func.__name__)
+
+    def report(self):
+        return {
+            "phases": {
+                key: {
+                    "time_ms": round(1000 * phase["time"], 3),
+                    "calls": phase["calls"],
+                    "counters": phase["counters"],
+                    "peak_memory": phase.get("peak_memory"),
+                }
+                for key, phase in self.phases.items()
+            },
+            "counters": self.totals,
+            "top": {
+                kind: [
+                    [key, round(1000 * seconds, 3)]
+                    for key, seconds in sorted(
+                        items.items(), key=lambda item: item[1], reverse=True
+                    )[: self.top]
+                ]
+                for kind, items in self.items.items()
+            },
+            "peak_memory": peak_memory(),
+        }
+
+    def write(self, filename):
+        with open(filename, mode="w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+profiler = Profiler()
+
+
+def parse_file(root_path, filename, is_entrypoint, content=None):
+    with profiler.collect() as counters:
+        t0 = perf_counter()
+        file = File(filename, is_entrypoint)
+        file.load(root_path, content)
+        result = file.dump()
+        file.close()
+    return result, perf_counter() - t0, counters
+
+
+class Autoload:
+    """PSR-4 map of a composer.json, resolving FQCNs to `filenames`"""
+
+    def __init__(self, path, filenames):
+        with open(path) as f:
+            data = json.load(f)
+        base = os.path.dirname(path)
+        self.filenames = filenames
+        self.prefixes = []
+        self.files = set()
+        for section in ("autoload", "autoload-dev"):
+            autoload = data.get(section, {})
+            for prefix, dirs in autoload.get("psr-4", {}).items():
+                dirs = [dirs] if isinstance(dirs, str) else dirs
+                self.prefixes += [
+                    (prefix, [os.path.realpath(os.path.join(base, d)) for d in dirs])
+                ]
+            self.files.update(
+                os.path.realpath(os.path.join(base, filename))
+                for filename in autoload.get("files", [])
+            )
+        self.prefixes.sort(key=lambda item: len(item[0]), reverse=True)
+
+    def covers(self, filename):
+        return any(
+            filename.startswith(os.path.join(d, ""))
+            for _, dirs in self.prefixes
+            for d in dirs
+        )
+
+    def matching(self, name):
+        """-> filenames of the classes whose FQCN starts with `name`, like
+        the ignored classes and prefixes are matched"""
+        found = set()
+        for prefix, dirs in self.prefixes:
+            if name.startswith(prefix):
+                rest = name[len(prefix) :].replace("\\", os.sep)
+            elif prefix.startswith(name):
+                rest = ""
+            else:
+                continue
+            for d in dirs:
+                start = os.path.join(d, rest)
+                found.update(
+                    filename
+                    for filename in self.filenames
+                    if filename.startswith(start)
+                )
+        return found
+
+    def find(self, fqcn):
+        for prefix, dirs in self.prefixes:
+            if fqcn.startswith(prefix):
+                relpath = fqcn[len(prefix) :].replace("\\", os.sep) + ".php"
+                for d in dirs:
+                    filename = os.path.join(d, relpath)
+                    if filename in self.filenames:
+                        return filename
+        return None
+
+
+def imported_classes(file, references, names):
+    """-> FQCNs `file` may use: its imports, its qualified references and
+    the names of its code relative to its namespace"""
+    found = {name.replace("\\\\", "\\") for name in references}
+    found.update(file.raw_imports)
+    for name in names:
+        if name.startswith("\\"):
+            found.add(name[1:])
+        elif file.namespace is not None:
+            found.add(f"{file.namespace}\\{name}")
+    return found
+
+
+def analyse_shard(ids):
+    """-> callers of the DB.shared classes `ids`, profiler counters"""
+    with profiler.collect() as counters:
+        db = DB.shared
+        result = [db.files[i].find_callers(db) for i in ids]
+    return result, counters
+
+
+def analyse_funcs_shard(ids):
+    """-> callers of the functions of the used DB.shared classes `ids`,
+    profiler counters"""
+    with profiler.collect() as counters:
+        db = DB.shared
+        result = []
+        for i in ids:
+            file = db.files[i]
+            file.used = True
+            for func in file.functions:
+                func.caller_ids = array("i")
+            file.analyse_funcs(db)
+            result += [[func.caller_ids.tolist() for func in file.functions]]
+    return result, counters
 
 
 class DB:
-    def __init__(self, root_path, entrypoint_paths):
+    shared = None  # the DB of the main process, in scan workers
+
+    def __init__(
+        self,
+        root_path,
+        entrypoint_paths,
+        workers=1,
+        cache=None,
+        exclude=(),
+        composer=None,
+        scan_workers=None,
+        imports_only=False,
+        call_sites=False,
+    ):
         self.root_path = os.path.realpath(root_path)
+        self.workers = workers or os.cpu_count() or 1
+        self.scan_workers = self.workers if scan_workers is None else scan_workers
+        self.scan_workers = self.scan_workers or os.cpu_count() or 1
+        self.cache = cache
+        self.exclude = exclude
         self.entrypoint_paths = [
             os.path.realpath(os.path.join(root_path, path)) for path in entrypoint_paths
         ]
+        self.composer = composer and os.path.realpath(os.path.join(root_path, composer))
+        self.imports_only = imports_only
+        self.call_sites = call_sites
+        self.references = {}
         self.files = []
         self.entrypoints = []
+        self.unreached = []
         self.classes = {}
+        self.index = Index()
+        self.lower_index = Index()
         self.invalid_roots = []
         self.invalid_roots_deprecated = []
         self.unused = []
         self.used = []
         self.unused_func = []
         self.unused_func_lines = 0
+        self.reached_by = array("i")
 
     def init(self):
-        filenames = dir_walk(self.root_path, file_filter=r".+\.php$")
-        self.files = [File(filename, False) for filename in filenames]
+        with profiler.phase("init"):
+            self.walk()
 
-        self.entrypoints = dir_walk(*self.entrypoint_paths, file_filter=r".+\.php$")
-        self.files += [File(filename, True) for filename in self.entrypoints]
+    def walk(self):
+        filenames = dir_walk(
+            self.root_path, file_filter=r".+\.php$", exclude=self.exclude
+        )
+        self.files = [File(filename, False, self) for filename in filenames]
+
+        self.entrypoints = list(
+            dir_walk(
+                *self.entrypoint_paths, file_filter=r".+\.php$", exclude=self.exclude
+            )
+        )
+        self.files += [File(filename, True, self) for filename in self.entrypoints]
+
+        for i, file in enumerate(self.files):
+            file.id = i
 
     def load(self):
-        for file in self.files:
-            file.load(self.root_path)
+        with profiler.phase("load"):
+            with profiler.phase("parse"):
+                if self.cache is not None:
+                    self.cache.load()
+                with self.pool() as pool:
+                    if self.composer is None:
+                        self.parse(self.files, pool)
+                    else:
+                        self.parse_reachable(pool)
+                if self.cache is not None:
+                    self.cache.save()
+            with profiler.phase("find_duplicates"):
+                self.find_duplicates()
+            with profiler.phase("registry"):
+                self.build_registry()
+            if not self.imports_only:
+                with profiler.phase("index"):
+                    self.resolve_names()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["cache"] = None
+        return state
+
+    @staticmethod
+    def init_worker(profiling, db=None):
+        profiler.configure(profiling)
+        DB.shared = db
+
+    @contextmanager
+    def pool(self, workers=None, shared=False):
+        """Worker processes, with this DB as `DB.shared` in each if `shared`
+        (copied once per worker, not per task)"""
+        workers = workers or self.workers
+        if workers > 1:
+            with ProcessPoolExecutor(
+                workers,
+                initializer=DB.init_worker,
+                initargs=(profiler.enabled, self if shared else None),
+            ) as pool:
+                yield pool
+        else:
+            yield None
+
+    def parse(self, files, pool=None):
+        """Parse or read from the cache `files` and index them
+        -> names they reference, for parse_reachable"""
+        results = [None] * len(files)
+        stamps = [None] * len(files)
+        if self.cache is not None:
+            cached = [
+                self.cache.get(file.filename, file.is_entrypoint) for file in files
+            ]
+            stamps = [stamp for stamp, _ in cached]
+            results = [result for _, result in cached]
+
+        to_parse = [i for i, result in enumerate(results) if result is None]
+        args = (
+            [self.root_path] * len(to_parse),
+            [files[i].filename for i in to_parse],
+            [files[i].is_entrypoint for i in to_parse],
+        )
+        if pool is not None and len(to_parse) > 1:
+            chunksize = max(1, len(to_parse) // (4 * self.workers))
+            parsed = list(pool.map(parse_file, *args, chunksize=chunksize))
+        else:
+            parsed = list(map(parse_file, *args))
+
+        for i, (result, seconds, counters) in zip(to_parse, parsed):
+            results[i] = result
+            profiler.item("files", files[i].filename, seconds)
+            profiler.merge(counters)
+            if self.cache is not None:
+                self.cache.put(
+                    files[i].filename, files[i].is_entrypoint, stamps[i], result
+                )
+
+        return [self.restore(file, result) for file, result in zip(files, results)]
 
+    def restore(self, file, result):
+        """Restore a parse result in `file` and index it
+        -> (qualified names, identifiers) it references"""
+        tokens, lower_tokens, references, names = file.restore(result)
+        if self.imports_only:
+            self.references[file] = imported_classes(file, references, names)
+        else:
+            self.index.add(file, tokens)
+            if not self.call_sites:
+                self.lower_index.add(file, lower_tokens)
+        return references, tokens
+
+    def parse_reachable(self, pool=None):
+        """Parse the entrypoints, the composer `files`, the files outside of
+        the PSR-4 directories and the ignored classes (used whatever calls
+        them), then the files their names resolve to through the PSR-4 map,
+        round after round. The files never reached are only listed in
+        `unreached`."""
+        by_filename = {file.filename: file for file in self.files}
+        autoload = Autoload(self.composer, by_filename)
+        ignored = set()
+        for name in File.ignored:
+            ignored.update(autoload.matching(name))
+        queue = [
+            file
+            for file in self.files
+            if file.is_entrypoint
+            or file.filename in autoload.files
+            or file.filename in ignored
+            or not autoload.covers(file.filename)
+        ]
+        reached = set(queue)
+        while queue:
+            references = self.parse(queue, pool)
+            found = []
+            for file, (names, tokens) in zip(queue, references):
+                candidates = {name.replace("\\\\", "\\") for name in names}
+                candidates.update(file.raw_imports)
+                if file.namespace is not None:
+                    candidates.update(
+                        [f"{file.namespace}\\{name}" for name in candidates]
+                        + [f"{file.namespace}\\{name}" for name in tokens]
+                    )
+                for name in candidates:
+                    other = by_filename.get(autoload.find(name))
+                    if other is not None and other not in reached:
+                        reached.add(other)
+                        found += [other]
+            queue = sorted(found, key=lambda file: file.id)
+            profiler.count("rounds")
+
+        self.unreached = [file.filename for file in self.files if file not in reached]
+        self.files = [file for file in self.files if file in reached]
+        for i, file in enumerate(self.files):
+            file.id = i
+
+    def find_duplicates(self):
+        self.by_fqcn = {}
         for file in self.files:
-            file.find_duplicates(self)
+            if file.is_class:
+                self.by_fqcn.setdefault(file.full_classname, []).append(file)
+        for full_classname, files in self.by_fqcn.items():
+            if len(files) > 1:
+                print("duplicates for:", full_classname)
+                print(" ∟", files[0].filename)
+                for file in files[1:]:
+                    print(" ∟", file.filename)
+                    file.namespace = None
 
+    def build_registry(self):
+        """Index files by short classname and resolve the inheritance closure.
+
+        `extends` only gives a short name, so a parent is any file declaring
+        that classname, like analyse_funcs always matched them.
+        """
         self.classes = {
             file.full_classname: file for file in self.files if file.is_class
         }
+        self.by_name = {}
+        for file in self.files:
+            if file.classname is not None:
+                self.by_name.setdefault(file.classname, []).append(file)
+        self.children = {}
+        for file in self.files:
+            if file.parent is not None:
+                self.children.setdefault(file.parent, []).append(file)
 
-    def scan(self):
-        for file in self.classes.values():
-            file.analyse(self)
+        self.ancestors = {}
+        self.descendants = {}
+        for file in self.files:
+            if file.parent is not None:
+                self.ancestors[file] = closure(
+                    file, lambda current: self.by_name.get(current.parent, [])
+                )
+            if file.classname in self.children:
+                self.descendants[file] = closure(
+                    file, lambda current: self.children.get(current.classname, [])
+                )
+
+    def resolve_names(self):
+        self.index.resolve(
+            [file.classname for file in self.classes.values()]
+            + [alias for file in self.files for alias in file.alias_imports.values()]
+        )
+        if not self.call_sites:
+            self.lower_index.resolve(
+                func.name.lower() for file in self.files for func in file.functions
+            )
 
+    def scan(self):
+        """With several scan workers, the classes are split in shards whose
+        callers and function callers are found in worker processes, then
+        merged in class order: the result is the same as a serial scan."""
+        if self.imports_only:
+            return self.scan_imports()
+        with profiler.phase("scan"), self.pool(self.scan_workers, True) as pool:
+            with profiler.phase("analyse"):
+                if pool is None:
+                    for file in self.classes.values():
+                        profiler.measure(
+                            "classes", file.full_classname, file.analyse, self
+                        )
+                else:
+                    for file, callers in self.map_shards(
+                        pool, analyse_shard, list(self.classes.values())
+                    ):
+                        file.link(self, callers)
+
+            with profiler.phase("resolve"):
+                self.resolve()
+                self.split_classes()
+
+            with profiler.phase("analyse_funcs"):
+                # call sites are cheap to match, and need the callers just linked
+                if pool is None or self.call_sites:
+                    for file in self.classes.values():
+                        profiler.measure(
+                            "classes", file.full_classname, file.analyse_funcs, self
+                        )
+                else:
+                    for file, callers in self.map_shards(
+                        pool, analyse_funcs_shard, self.used
+                    ):
+                        for func, ids in zip(file.functions, callers):
+                            func.caller_ids = array("i", ids)
+                self.find_unused_functions()
+
+    def scan_imports(self):
+        """Approximate scan linking files only to the classes they import,
+        name relative to their namespace or by qualified name, without
+        counting mentions; functions are not analysed"""
+        with profiler.phase("scan"):
+            with profiler.phase("analyse"):
+                for file in self.files:
+                    called = {
+                        self.classes[name]
+                        for name in self.references.get(file, ())
+                        if name in self.classes
+                    }
+                    called.discard(file)
+                    for other in sorted(called, key=lambda other: other.id):
+                        other.caller_ids.append(file.id)
+                        file.called_ids.append(other.id)
+            with profiler.phase("resolve"):
+                self.resolve()
+                self.split_classes()
+            self.unused_func = []
+            self.unused_func_lines = 0
+
+    def map_shards(self, pool, func, files):
+        """Yield (file, result) of `func` run on shards of `files`, in order"""
+        size = max(1, -(-len(files) // (4 * self.scan_workers)))
+        shards = [files[i : i + size] for i in range(0, len(files), size)]
+        results = pool.map(func, [[file.id for file in shard] for shard in shards])
+        for shard, (result, counters) in zip(shards, results):
+            profiler.merge(counters)
+            profiler.count("shards")
+            yield from zip(shard, result)
+
+    def scan_targets(self, names):
+        """Compute only what print_specific shows for the `names` classes:
+        their callers and function callers, and the callers and used flag of
+        all of them, found by walking callers back until a root. Other
+        classes are left unanalysed (no callers, not used)."""
+        with profiler.phase("scan"):
+            analysed = set()
+            known = {}
+
+            def callers(file):
+                if file not in analysed:
+                    analysed.add(file)
+                    profiler.measure("classes", file.full_classname, file.analyse, self)
+                return file.callers
+
+            def used(file):
+                """Same result as resolve: a root, or a class which is not
+                deprecated with a used caller"""
+                if file in known:
+                    return known[file]
+                parents = {file: None}
+                queue = [file]
+                found = None
+                for current in queue:
+                    if known.get(current) or current.is_root:
+                        found = current
+                        break
+                    if current.deprecated:
+                        continue
+                    for caller in callers(current):
+                        if caller not in parents and known.get(caller) is not False:
+                            parents[caller] = current
+                            queue += [caller]
+                if found is None:
+                    for current in queue:
+                        known[current] = False
+                while found is not None:
+                    known[found] = found.used = True
+                    found = parents[found]
+                return file.used
+
+            targets = [self.classes[name] for name in names if name in self.classes]
+            with profiler.phase("resolve"):
+                for file in targets:
+                    used(file)
+                    for caller in callers(file):
+                        used(caller)
+                        callers(caller)
+            with profiler.phase("analyse_funcs"):
+                for file in targets:
+                    if self.call_sites:  # what analyse_calls relates to it
+                        for other in file.interface_files(self):
+                            callers(other)
+                            for child in self.descendants.get(other, ()):
+                                callers(child)
+                        for other in self.descendants.get(file, ()):
+                            callers(other)
+                        for other in self.classes.values():
+                            if (
+                                other.type == "trait"
+                                and self.index.count(file, other.classname) > 0
+                            ):
+                                callers(other)
+                    file.analyse_funcs(self)
+                    for func in file.functions:
+                        for caller in func.callers:
+                            used(caller)
+                            callers(caller)
+            return len(analysed)
+
+    def split_classes(self):
         self.invalid_roots = [
             file for file in self.classes.values() if file.is_invalid_root(False)
         ]
@@ -150,24 +1311,231 @@ class DB:
         self.unused = [file for file in self.classes.values() if not file.is_used]
         self.used = [file for file in self.classes.values() if file.is_used]
 
-        for file in self.classes.values():
-            file.analyse_funcs(self)
-
+    def find_unused_functions(self):
         self.unused_func = [
             func for file in self.used for func in file.get_unused_functions()
         ]
         self.unused_func_lines = sum([func.lines for func in self.unused_func])
 
+    def resolve(self):
+        """Flag every class reachable from a used file through `called`.
+
+        Files which are not classes, ignored classes and classes under an
+        ignored prefix are used; deprecated classes are only used when
+        explicitly ignored, and stop the propagation otherwise.
+        `reached_by` keeps the file each class was reached from (-1 on roots).
+        """
+        queue = []
+        self.reached_by = array("i", [-1]) * len(self.files)
+        for file in self.files:
+            file.used = file.is_root
+            if file.used:
+                queue += [file]
+        for file in queue:
+            for called in map(self.files.__getitem__, file.called_ids):
+                if not called.used and not called.deprecated:
+                    called.used = True
+                    self.reached_by[called.id] = file.id
+                    queue += [called]
+
+    def stamps(self):
+        """-> {filename: (mtime, size)} of the files to load currently on disk"""
+        stamps = {}
+        for filename in dir_walk(
+            self.root_path,
+            *self.entrypoint_paths,
+            file_filter=r".+\.php$",
+            exclude=self.exclude,
+        ):
+            try:
+                stat = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            stamps[filename] = (stat.st_mtime_ns, stat.st_size)
+        return stamps
+
+    def tracks(self, filename):
+        """Whether `filename` would be loaded by `walk` if it existed"""
+        if not filename.endswith(".php"):
+            return False
+        for root in [self.root_path] + self.entrypoint_paths:
+            if os.path.commonpath([root, filename]) != root:
+                continue
+            parts = os.path.relpath(filename, root).split(os.sep)
+            return not any(
+                fnmatch(name, glob) or fnmatch("/".join(parts[: i + 1]), glob)
+                for i, name in enumerate(parts)
+                for glob in self.exclude
+            )
+        return False
+
+    def update(self, filenames, contents=None):
+        """Re-parse changed, added or removed files and recompute what they
+        touch: their outgoing edges, the used flags and the callers of the
+        functions they mention. `contents` gives the content of each file
+        instead of reading it (b"" for a missing file).
+
+        When the class declared by a file changes (added, removed, renamed or
+        extending another parent), every class is linked again instead,
+        still without parsing the other files.
+        """
+        with profiler.phase("update"):
+            by_filename = {file.filename: file for file in self.files}
+            changed = []
+            relink = False
+            for filename in filenames:
+                file = by_filename.get(filename)
+                if file is None:
+                    is_entrypoint = any(
+                        os.path.commonpath([path, filename]) == path
+                        for path in self.entrypoint_paths
+                    )
+                    file = File(filename, is_entrypoint, self)
+                    file.id = len(self.files)
+                    self.files += [file]
+                    if is_entrypoint:
+                        self.entrypoints += [filename]
+                identity = (
+                    file.is_class,
+                    file.full_classname,
+                    file.type,
+                    file.parent,
+                    file.interfaces,
+                )
+
+                for i in file.called_ids:
+                    self.files[i].caller_ids.remove(file.id)
+                file.called_ids = array("i")
+                file._imports = None
+                self.index.remove(file)
+                self.lower_index.remove(file)
+
+                if contents is not None:
+                    result = parse_file(
+                        self.root_path, filename, file.is_entrypoint, contents[filename]
+                    )[0]
+                else:
+                    result = self.reparse(file)
+                self.restore(file, result)
+
+                changed += [file]
+                if identity != (
+                    file.is_class,
+                    file.full_classname,
+                    file.type,
+                    file.parent,
+                    file.interfaces,
+                ):
+                    relink = True
+
+            if relink or self.imports_only:
+                self.relink()
+            else:
+                self.link(changed)
+            if self.cache is not None:
+                self.cache.save()
+
+    def reparse(self, file):
+        """-> parse result of `file` on disk, empty if it was removed"""
+        try:
+            stamp = self.cache.stamp(file.filename) if self.cache else None
+            result = parse_file(self.root_path, file.filename, file.is_entrypoint)[0]
+            if self.cache is not None:
+                self.cache.put(file.filename, file.is_entrypoint, stamp, result)
+            return result
+        except FileNotFoundError:
+            empty = File(file.filename, file.is_entrypoint)
+            empty.content = b""
+            return empty.dump()
+
+    def relink(self):
+        for file in self.files:
+            file.caller_ids = array("i")
+            file.called_ids = array("i")
+            file._imports = None
+            for func in file.functions:
+                func.caller_ids = array("i")
+        self.find_duplicates()
+        self.build_registry()
+        if not self.imports_only:
+            self.resolve_names()
+        self.scan()
+
+    def link(self, changed):
+        """Link the `changed` files to the classes they call, then update the
+        used flags and the function callers depending on them (caller ids
+        are kept sorted)"""
+        used = {file: file.used for file in self.classes.values()}
+        for file in changed:
+            for other in self.classes.values():
+                if (
+                    other.filename != file.filename
+                    and self.index.count(file, other.classname) > 0
+                    and file.is_calling(self, other)
+                ):
+                    insort(other.caller_ids, file.id)
+                    file.called_ids.append(other.id)
+
+        self.resolve()
+        self.split_classes()
+
+        changed = set(changed)
+        if self.call_sites:  # the children of a caller call through it
+            for file in list(changed):
+                changed.update(self.descendants.get(file, ()))
+        ids = {file.id for file in changed}
+        for file in self.classes.values():
+            if file in changed or file.used != used.get(file):
+                for func in file.functions:
+                    func.caller_ids = array("i")
+                file.analyse_funcs(self)
+            else:
+                for func in file.functions:
+                    for i in ids:
+                        pos = bisect_left(func.caller_ids, i)
+                        if pos < len(func.caller_ids) and func.caller_ids[pos] == i:
+                            del func.caller_ids[pos]
+                file.analyse_funcs(self, changed)
+        self.find_unused_functions()
+
 
 class File:
+    __slots__ = (
+        "id",
+        "db",
+        "filename",
+        "content",
+        "is_entrypoint",
+        "classname",
+        "namespace",
+        "full_classname",
+        "type",
+        "raw_imports",
+        "alias_imports",
+        "functions",
+        "caller_ids",
+        "called_ids",
+        "deprecated",
+        "class_start_line",
+        "class_comment_lines",
+        "_imports",
+        "used",
+        "parent",
+        "reflexive_call",
+        "names",
+        "calls",
+        "interfaces",
+    )
+
     ignored = []
     ignored_func = []
 
-    def __init__(self, filename, is_entrypoint):
+    def __init__(self, filename, is_entrypoint, db=None):
+        self.id = None
+        self.db = db
         self.filename = filename
         self.content = None
         self.is_entrypoint = is_entrypoint
-        self.lines = []
         self.classname = None
         self.namespace = None
         self.full_classname = None
@@ -175,116 +1543,452 @@ class File:
         self.raw_imports = []
         self.alias_imports = {}
         self.functions = []
-        self.callers = []
-        self.called = []
+        self.caller_ids = array("i")
+        self.called_ids = array("i")
         self.deprecated = False
         self.class_start_line = None
         self.class_comment_lines = None
         self._imports = None
-        self._is_used = None
+        self.used = False
         self.parent = None
         self.reflexive_call = False
-
-    def load(self, root_path):
-        with open(os.path.join(root_path, self.filename)) as f:
-            self.content = f.read()
+        self.names = set()
+        self.calls = {}
+        self.interfaces = []
+
+    def load(self, root_path, content=None):
+        """Map the file in memory, unless its `content` is given: it is
+        scanned as bytes and only the names kept are decoded. `close`
+        releases it."""
+        if content is not None:
+            self.content = content
+        else:
+            with open(os.path.join(root_path, self.filename), mode="rb") as f:
+                if os.fstat(f.fileno()).st_size:
+                    self.content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    self.content = b""
         if not self.is_entrypoint:
-            self.lines = self.content.split("\n")
-            for i, line in enumerate(self.lines):
-                line = line.strip()
-                match_namespace = re.match(r"^namespace (App\\[\\\w]+);$", line)
-                match_import = re.match(r"^use (App\\[\\\w]+)( as (\w+))?;$", line)
-                match_class = re.match(
-                    r"^(abstract\s+)?(class|interface|trait)\s+(\w+)(\s+extends\s+(\w+))?",
-                    line,
-                )
-                match_function = re.match(
-                    r"^(abstract\s+)?(public|protected|private)\s+(static\s+)?function\s+(\w+)",
-                    line,
-                )
-                match_reflexive = re.match(
-                    r".*\$this->({\$|\$\w+\()",
-                    line,
-                )
-                if match_namespace and self.namespace is None:
-                    self.namespace = match_namespace.groups()[0]
-                if match_import:
-                    self.raw_imports += [match_import.groups()[0]]
-                    if match_import.groups()[2]:
-                        self.alias_imports[
-                            self.raw_imports[-1]
-                        ] = match_import.groups()[2]
-                if match_class and self.classname is None:
-                    self.class_line = i
+            self.parse()
+            if self.is_class:
+                self.full_classname = f"{self.namespace}\\{self.classname}"
+        else:
+            self.parse_calls()
+
+    def close(self):
+        if isinstance(self.content, mmap.mmap):
+            self.content.close()
+        self.content = None
+
+    def parse(self):
+        line_of = LineCounter(self.content)
+        depth = 0
+        prev = None  # previous significant token, lowercased
+        recent = (None,) * 4  # last tokens, for reflexive calls and call sites
+        doc = None  # docblock right before the current token
+        head = None  # start of the declaration being read: (offset, docblock)
+        modifiers = []
+        attribute = 0  # bracket depth inside #[...]
+        expect = None  # what the next name token is
+        imports = None  # names of the use statement being read
+        class_depth = None  # brace depth inside the class body
+        func = None  # method waiting for its ";" or body
+        parens = 0
+        body = None  # brace depth of the method body
+        func_start = None  # offset of the line declaring the method
+        callable = None  # string which is a callable unless it is a key
+        tokens = 0
+
+        for kind, text, pos in tokenize(self.content):
+            tokens += 1
+            if attribute:
+                if text == b"[" or text == b"(":
+                    attribute += 1
+                elif text == b"]" or text == b")":
+                    attribute -= 1
+                continue
+            if kind == "doc":
+                doc = (pos, text)
+                continue
+
+            lower = text.lower() if kind == "name" else text
+            at_start = prev in STATEMENT_ENDS or head is not None
+            if recent[-3] == b"$this" and recent[-2] == b"->":
+                if (recent[-1] == b"{" and kind == "var") or (
+                    recent[-1][:1] == b"$" and text == b"("
+                ):
+                    self.reflexive_call = True
+            callable = self.record_call(recent, callable, kind, text)
+            recent = recent[1:] + (text,)
+
+            if text == b"{":
+                depth += 1
+            elif text == b"}":
+                depth -= 1
+                if class_depth is not None and depth < class_depth:
+                    class_depth = None
+
+            if imports is not None:
+                if text == b";" or (text == b"{" and not imports["prefix"]):
+                    for name, alias in imports["names"]:
+                        profiler.count("regex")
+                        if IMPORT.fullmatch(name):
+                            self.raw_imports += [name]
+                            if alias is not None:
+                                self.alias_imports[name] = alias
+                    imports = None
+                elif kind == "name":
+                    if lower in (b"function", b"const") and not imports["names"]:
+                        imports["skip"] = True
+                    elif imports["skip"]:
+                        pass
+                    elif lower == b"as" and imports["names"]:
+                        imports["alias"] = True
+                    elif imports.pop("alias", False):
+                        imports["names"][-1] = (imports["names"][-1][0], decode(text))
+                    elif text.endswith(b"\\"):
+                        imports["prefix"] = decode(text).lstrip("\\")
+                    else:
+                        name = imports["group"] + decode(text).lstrip("\\")
+                        imports["names"] += [(name, None)]
+                elif text == b"{":
+                    imports["group"] = imports["prefix"]
+                elif text == b"}":
+                    imports["group"] = ""
+                prev = lower
+                continue
+
+            if kind == "name" and prev != b"->" and prev != b"?->":
+                self.names.add(text)
+
+            if func is not None:
+                if text == b"(":
+                    parens += 1
+                elif text == b")":
+                    parens -= 1
+                elif parens == 0 and body is None and (text == b";" or text == b"{"):
+                    if text == b";":
+                        self.close_function(func, func_start, pos, line_of(pos))
+                        func = None
+                    else:
+                        body = depth - 1
+                if body is not None and text == b"}" and depth == body:
+                    self.close_function(func, func_start, pos, line_of(pos))
+                    func = None
+                    body = None
+
+            if expect == "namespace":
+                expect = None
+                if kind == "name" and self.namespace is None:
+                    profiler.count("regex")
+                    if IMPORT.fullmatch(decode(text)):
+                        self.namespace = decode(text)
+            elif expect == "classname":
+                expect = "class"
+                if kind == "name":
+                    self.classname = decode(text)
                     (
                         self.class_start_line,
                         self.class_comment_lines,
                         self.deprecated,
-                    ) = backward_comment(self.lines, i)
-                    self.classname = match_class.groups()[2]
-                    self.type = match_class.groups()[1]
-                    if match_class.groups()[4] is not None:
-                        self.parent = match_class.groups()[4]
-                if match_function and not match_function.groups()[3].startswith("__"):
-                    func = Function(
-                        self, match_function.groups()[1], match_function.groups()[3], i
+                    ) = self.declaration(head, line_of)[1:]
+                else:
+                    expect = None
+            elif expect == "class" or expect == "interfaces":
+                if lower == b"extends" and expect == "class":
+                    expect = "parent"
+                elif lower == b"implements":
+                    expect = "interfaces"
+                elif text == b"{":
+                    class_depth = depth
+                    expect = None
+                elif expect == "interfaces" and kind == "name":
+                    name = decode(text).rstrip("\\").rsplit("\\", 1)[-1]
+                    self.interfaces += [name]
+            elif expect == "parent":
+                expect = "class"
+                if kind == "name":
+                    self.parent = decode(text).rstrip("\\").rsplit("\\", 1)[-1]
+            elif expect == "function":
+                if text == b"&":
+                    prev = lower
+                    continue
+                expect = None
+                if kind == "name" and not text.startswith(b"__"):
+                    visibility = [m for m in modifiers if m in VISIBILITIES][0]
+                    line, start_line, comment_lines, deprecated = self.declaration(
+                        head, line_of
                     )
-                    func.load()
-                    self.functions += [func]
-                if match_reflexive:
-                    self.reflexive_call = True
-            if self.is_class:
-                self.full_classname = f"{self.namespace}\\{self.classname}"
+                    func = Function(self, decode(visibility), decode(text), line)
+                    func_start = self.content.rfind(b"\n", 0, head[0]) + 1
+                    func.start_line = start_line
+                    func.comment_lines = comment_lines
+                    func.deprecated = deprecated
+                    parens = 0
+            elif kind == "op" and text == b"#[" and at_start:
+                head = head or (pos, doc)
+                attribute = 1
+                prev = lower
+                continue
+            elif kind == "name" and at_start:
+                if lower in MODIFIERS:
+                    head = head or (pos, doc)
+                    modifiers += [lower]
+                    prev = lower
+                    continue
+                elif lower == b"namespace" and head is None:
+                    expect = "namespace"
+                elif lower == b"use" and head is None:
+                    imports = {"names": [], "prefix": "", "group": "", "skip": False}
+                elif (
+                    lower in (b"class", b"interface", b"trait")
+                    and self.classname is None
+                ):
+                    head = head or (pos, doc)
+                    self.type = decode(lower)
+                    expect = "classname"
+                    prev = lower
+                    continue
+                elif (
+                    lower == b"function"
+                    and func is None
+                    and class_depth == depth
+                    and VISIBILITIES.intersection(modifiers)
+                ):
+                    head = head or (pos, doc)
+                    expect = "function"
+                    prev = lower
+                    continue
+
+            head = None
+            modifiers = []
+            doc = None
+            prev = lower
+
+        profiler.count("regex")
+        profiler.count("tokens", tokens)
+
+    def parse_calls(self):
+        """Record only the call sites, for entrypoints: routes and config
+        files call controller actions but declare nothing"""
+        recent = (None,) * 4
+        callable = None
+        for kind, text, _ in tokenize(self.content):
+            if kind != "doc":
+                callable = self.record_call(recent, callable, kind, text)
+                recent = recent[1:] + (text,)
+
+    def record_call(self, recent, callable, kind, text):
+        """Record the call site ending with the token `text`, after the
+        `recent` ones. -> the string `callable` waiting for the next token,
+        which is not one when it is an array key."""
+        if callable is not None:
+            if text != b"=":  # not followed by =>
+                self.add_call(*callable)
+            callable = None
+        if kind == "name" and (recent[-1] == b"->" or recent[-1] == b"?->"):
+            self.add_call(recent[-2] if recent[-2] == b"$this" else b"", text)
+        elif text == b"(" and recent[-2] == b"::" and IDENTIFIER.fullmatch(recent[-1]):
+            receiver = recent[-3] or b""
+            if not IDENTIFIER.fullmatch(receiver.replace(b"\\", b"")):
+                receiver = b""  # $object::, a call result...
+            self.add_call(receiver, recent[-1])
+        elif kind == "string" and recent[-1] in (b",", b"(", b"["):
+            match = CALLABLE.fullmatch(text, 1, len(text) - 1)
+            if match is not None:
+                receiver = (match["class"] or b"").replace(b"\\\\", b"\\")
+                if receiver and receiver[:1] != b"\\":  # qualified in strings
+                    receiver = b"\\" + receiver
+                elif (
+                    not receiver
+                    and recent[-1] == b","
+                    and recent[-2].lower() == b"class"
+                    and recent[-3] == b"::"
+                ):
+                    receiver = recent[-4]  # [Foo::class, 'method']
+                callable = (receiver, match["name"])
+        return callable
+
+    def add_call(self, receiver, name):
+        """Record a call site of the method `name` on `receiver`: b"" when
+        unknown, b"$this" for $this, self and static, else a class name"""
+        lower = receiver.lower()
+        if lower in (b"self", b"static"):
+            receiver = b"$this"
+        elif lower == b"parent":
+            receiver = lower
+        self.calls.setdefault(name.lower(), set()).add(receiver)
+
+    def declaration(self, head, line_of):
+        """-> (line, start_line, comment_lines, deprecated) of a declaration,
+        its docblock and the blank line above them"""
+        pos, doc = head
+        start_line = line = line_of(pos)
+        deprecated = False
+        if doc is not None:
+            pos = doc[0]
+            start_line = line_of(pos)
+            deprecated = b"@deprecated" in doc[1].lower()
+        start = self.content.rfind(b"\n", 0, pos) + 1
+        if start > 0:
+            above_start = self.content.rfind(b"\n", 0, start - 1) + 1
+            above = self.content[above_start : start - 1]
+            if not above.strip():
+                start_line -= 1
+        return line, start_line, line - start_line, deprecated
+
+    def close_function(self, func, start, pos, end_line):
+        """`start` is the offset of the declaration line, `pos` the one of
+        the token ending the method"""
+        func.end_line = end_line
+        end = self.content.find(b"\n", pos)
+        span = self.content[start : end if end != -1 else len(self.content)]
+        name = func.name.encode("utf-8", "surrogateescape").lower()
+        func.call_other_same = span.lower().count(name) > 1
+        self.functions += [func]
+
+    def dump(self):
+        profiler.count("regex", 2)
+        return (
+            self.namespace,
+            self.classname,
+            self.full_classname,
+            self.type,
+            self.parent,
+            self.raw_imports,
+            self.alias_imports,
+            self.deprecated,
+            self.class_start_line,
+            self.class_comment_lines,
+            self.reflexive_call,
+            [func.dump() for func in self.functions],
+            *self.identifiers(),
+            sorted({decode(name) for name in REFERENCE.findall(self.content)}),
+            sorted(decode(name) for name in self.names),
+            sorted(
+                (decode(name), sorted(map(decode, receivers)))
+                for name, receivers in self.calls.items()
+            ),
+            self.interfaces,
+        )
 
-    def find_duplicates(self, db):
-        if self.is_class:
-            dups = [
-                file
-                for file in db.files
-                if file != self
-                and file.is_class
-                and file.full_classname == self.full_classname
-            ]
-            if len(dups) > 0:
-                print("duplicates for:", self.full_classname)
-                print(" ∟", self.filename)
-                for file in dups:
-                    print(" ∟", file.filename)
-                    file.namespace = None
+    def identifiers(self):
+        """-> ({identifier: count}, {lowercased identifier: count}), lowered
+        per identifier like PHP does (ASCII only) instead of the content"""
+        counts = Counter(IDENTIFIER.findall(self.content))
+        if not counts:
+            return {}, {}
+        joined = b"\n".join(counts)  # decoded at once, identifiers have no "\n"
+        tokens = dict(zip(decode(joined).split("\n"), counts.values()))
+        lower_tokens = {}
+        for lower, count in zip(decode(joined.lower()).split("\n"), counts.values()):
+            lower_tokens[lower] = lower_tokens.get(lower, 0) + count
+        return tokens, lower_tokens
+
+    def restore(self, result):
+        (
+            self.namespace,
+            self.classname,
+            self.full_classname,
+            self.type,
+            self.parent,
+            self.raw_imports,
+            self.alias_imports,
+            self.deprecated,
+            self.class_start_line,
+            self.class_comment_lines,
+            self.reflexive_call,
+            functions,
+            tokens,
+            lower_tokens,
+            references,
+            names,
+            calls,
+            self.interfaces,
+        ) = result
+        self.namespace = intern(self.namespace)
+        self.classname = intern(self.classname)
+        self.full_classname = intern(self.full_classname)
+        self.type = intern(self.type)
+        self.parent = intern(self.parent)
+        self.interfaces = [sys.intern(name) for name in self.interfaces]
+        self.raw_imports = [sys.intern(name) for name in self.raw_imports]
+        self.alias_imports = {
+            sys.intern(name): sys.intern(alias)
+            for name, alias in self.alias_imports.items()
+        }
+        self.functions = [Function.restore(self, data) for data in functions]
+        self.calls = {
+            sys.intern(name): tuple(map(sys.intern, receivers))
+            for name, receivers in calls
+        }
+        return tokens, lower_tokens, references, names
+
+    def read(self):
+        """-> content as bytes, where the parser line numbers count b"\n" """
+        with open(self.filename, mode="rb") as f:
+            return f.read()
 
     def analyse(self, db):
-        if self.is_class:
-            for file in db.files:
-                if file.filename != self.filename and file.is_calling(db, self):
-                    self.callers += [file]
-                    file.called += [self]
+        self.link(db, self.find_callers(db))
+
+    def find_callers(self, db):
+        """-> ids of the files calling this class"""
+        if not self.is_class:
+            return []
+        return [
+            file.id
+            for file in db.index.files(self.classname)
+            if file.filename != self.filename and file.is_calling(db, self)
+        ]
 
-    def analyse_funcs(self, db):
-        if self.is_class and self.is_used:
+    def link(self, db, callers):
+        for i in callers:
+            self.caller_ids.append(i)
+            db.files[i].called_ids.append(self.id)
+
+    def analyse_funcs(self, db, files=None):
+        """`files` limits the callers looked at, to update the functions of
+        this class after these files changed"""
+        if self.is_class and self.is_used and db.call_sites:
+            self.analyse_calls(db, files)
+        elif self.is_class and self.is_used:
             public_func = [
                 func
                 for func in self.functions
                 if func.type == "public" or func.type == "protected"
             ]
-            for file in db.files:
+            names = [func.name.lower() for func in self.functions]
+            hits = dict(zip(self.functions, map(db.lower_index.get, names)))
+            ancestors = db.ancestors.get(self, ())
+            descendants = db.descendants.get(self, ())
+            if files is None:
+                add = array.append
+                files = db.lower_index.files(*names)
+            else:
+                add = insort
+                files = [
+                    file for file in files if any(file in hit for hit in hits.values())
+                ]
+            for file in files:
                 if file == self:
                     for func in self.functions:
-                        if file.content.lower().count(func.name.lower()) >= 2:
-                            func.callers += [file]
-                elif self.parent is not None and self.parent == file.classname:
+                        if hits[func].get(file, 0) >= 2:
+                            add(func.caller_ids, file.id)
+                elif file in ancestors:
                     for func in public_func:
-                        if file.content.lower().count(func.name.lower()) >= 2:
-                            func.callers += [file]
-                elif file.parent is not None and file.parent == self.classname:
+                        if hits[func].get(file, 0) >= 2:
+                            add(func.caller_ids, file.id)
+                elif file in descendants:
                     for func in public_func:
                         for other_func in file.functions:
                             if other_func.name == func.name:
-                                if file.content.lower().count(func.name.lower()) >= 2:
-                                    func.callers += [file]
+                                if hits[func].get(file, 0) >= 2:
+                                    add(func.caller_ids, file.id)
                                 break
                         else:
-                            if re.search(func.name.lower(), file.content.lower()):
-                                func.callers += [file]
+                            if file in hits[func]:
+                                add(func.caller_ids, file.id)
                 else:
                     for func in public_func:
                         for other_func in file.functions:
@@ -295,54 +1999,143 @@ class File:
                             ):
                                 break
                         else:
-                            if re.search(func.name.lower(), file.content.lower()):
-                                func.callers += [file]
+                            if file in hits[func]:
+                                add(func.caller_ids, file.id)
+
+    def analyse_calls(self, db, files=None):
+        """Like analyse_funcs, from the call sites recorded while parsing: a
+        file calls a method when it calls its name on a receiver which can be
+        this class. Scopes are called by their short name or their method
+        name.
+
+        Only the files related to this class can: itself, its parents and
+        children, its callers and their children, the callers of its children
+        and the traits it uses. They are much fewer than the files mentioning
+        a common method name. A public method is also called where it is
+        called on an interface the class implements, related the same way.
+        """
+        names = {
+            func: (func.name.lower(), f"scope{func.name.lower()}")
+            for func in self.functions
+        }
+        found = {func: set() for func in self.functions}
+        for target in [self, *self.interface_files(db)]:
+            linked = set(target.caller_ids)
+            related = target.related_files(db, linked)
+            for file in related if files is None else related.intersection(files):
+                if not file.calls:
+                    continue
+                for func in self.functions:
+                    receivers = [
+                        receiver
+                        for name in names[func]
+                        for receiver in file.calls.get(name, ())
+                    ]
+                    if (
+                        receivers
+                        and (file == self or func.type != "private")
+                        and (target == self or func.type == "public")
+                        and any(
+                            target.is_receiver(db, file, func, receiver, linked)
+                            for receiver in receivers
+                        )
+                    ):
+                        found[func].add(file.id)
+        add = array.append if files is None else insort
+        for func, ids in found.items():
+            for i in sorted(ids):
+                add(func.caller_ids, i)
+
+    def related_files(self, db, linked):
+        """-> files which can call the methods of this class, see
+        analyse_calls"""
+        descendants = db.descendants.get(self, ())
+        related = {self, *db.ancestors.get(self, ()), *descendants}
+        for i in linked:
+            related.add(db.files[i])
+            related.update(db.descendants.get(db.files[i], ()))
+        for other in descendants:
+            related.update(other.callers)
+        related.update(other for other in self.called if other.type == "trait")
+        return related
+
+    def interface_files(self, db):
+        """-> interfaces implemented by this class or its parents, and the
+        ones they extend"""
+        found = set()
+        for file in [self, *db.ancestors.get(self, ())]:
+            for name in file.interfaces:
+                for other in db.by_name.get(name, ()):
+                    if other.type == "interface" and other.is_class:
+                        found.add(other)
+                        found.update(db.ancestors.get(other, ()))
+        found.discard(self)
+        return sorted(found, key=lambda file: file.id)
+
+    def is_receiver(self, db, file, func, receiver, linked):
+        """Whether a call of `func` on `receiver` in `file` can reach this
+        class. Unknown receivers are only trusted in the files `linked` to
+        it (the ids of its callers), or whose parent is."""
+        ancestors = db.ancestors.get(self, ())
+        descendants = db.descendants.get(self, ())
+        if file == self:
+            return True
+        if receiver == "":
+            return (
+                file in ancestors
+                or file in descendants
+                or file.id in linked
+                or any(other.id in linked for other in db.ancestors.get(file, ()))
+            )
+        if receiver == "$this":
+            if file in descendants:
+                return not any(other.name == func.name for other in file.functions)
+            return (
+                file in ancestors
+                or (self.type == "trait" and file.id in linked)
+                or (file.type == "trait" and file.id in self.called_ids)
+            )
+        if receiver == "parent":
+            return file in descendants
+        other = db.classes.get(file.resolve_class(receiver))
+        if other is None and file.is_entrypoint and file.id in linked:
+            # entrypoints are not parsed for their imports
+            short = receiver.rstrip("\\").rsplit("\\", 1)[-1]
+            return any(
+                other == self or other in descendants
+                for other in db.by_name.get(short, ())
+            )
+        return other == self or other in descendants
+
+    def resolve_class(self, name):
+        """-> FQCN of the class `name` written in this file"""
+        if name.startswith("\\"):
+            return name[1:]
+        first, _, rest = name.partition("\\")
+        for imp in self.raw_imports:
+            if self.alias_imports.get(imp, imp.rsplit("\\", 1)[-1]) == first:
+                return f"{imp}\\{rest}" if rest else imp
+        return f"{self.namespace}\\{name}" if self.namespace else name
 
     def is_calling(self, db, other_file):
+        profiler.count("is_calling")
         if self.is_class:
             for imp in self.get_imports(db):
                 if imp == other_file:
                     if imp.full_classname in self.alias_imports:
                         to_find = self.alias_imports[imp.full_classname]
-                        return self.content.count(to_find) >= 2
+                        return db.index.count(self, to_find) >= 2
                     to_detect = 3 if other_file.classname in self.classname else 2
                     # import + (classname) + usage
-                    return self.content.count(other_file.classname) >= to_detect
+                    return db.index.count(self, other_file.classname) >= to_detect
                 if (
                     other_file.classname in imp.classname
                     and imp.full_classname not in self.alias_imports
                 ):
                     return False
             if other_file.classname in self.classname:
-                return self.content.count(other_file.classname) >= 2
-            return re.search(other_file.classname, self.content)
-        else:
-            return re.search(other_file.classname, self.content)
-
-    def is_used_full(self, scanned):
-        if not self.is_class or self.full_classname in File.ignored:
-            return True
-        elif self.deprecated:
-            return False
-        if self._is_used is None:
-            for ign in File.ignored:
-                if self.full_classname.startswith(ign):
-                    self._is_used = True
-                    break
-            else:
-                should_update = True
-                for caller in self.callers:
-                    if caller not in scanned and caller.is_used_full(scanned + [self]):
-                        self._is_used = True
-                        break
-                    elif caller in scanned:
-                        should_update = False
-                else:
-                    if should_update:
-                        self._is_used = False
-                    else:
-                        return False
-        return self._is_used
+                return db.index.count(self, other_file.classname) >= 2
+        return db.index.count(self, other_file.classname) > 0
 
     def get_imports(self, db):
         if self._imports is None:
@@ -367,11 +2160,29 @@ class File:
                 len([caller for caller in self.callers if not caller.deprecated]) == 0
             )
         else:
-            return len(self.callers) == 0
+            return len(self.caller_ids) == 0
+
+    @property
+    def callers(self):
+        return [self.db.files[i] for i in self.caller_ids]
+
+    @property
+    def called(self):
+        return [self.db.files[i] for i in self.called_ids]
 
     @property
     def is_used(self):
-        return self.is_used_full([self])
+        return not self.is_class or self.used
+
+    @property
+    def is_root(self):
+        """Used whatever calls it: not a class, or ignored (by its exact name
+        only when deprecated)"""
+        if not self.is_class or self.full_classname in File.ignored:
+            return True
+        return not self.deprecated and self.full_classname.startswith(
+            tuple(File.ignored)
+        )
 
     @property
     def is_class(self):
@@ -385,9 +2196,9 @@ class File:
         if self.is_class:
             infos = [colorize(f"{len(self.functions)} functions")]
             if self.is_used:
-                infos += [colorize(f"{len(self.callers)} callers")]
-            elif len(self.callers) > 0:
-                infos += [colorize(f"{len(self.callers)} unused callers")]
+                infos += [colorize(f"{len(self.caller_ids)} callers")]
+            elif len(self.caller_ids) > 0:
+                infos += [colorize(f"{len(self.caller_ids)} unused callers")]
             else:
                 infos += [colorize(f"unused")]
             if self.parent is not None:
@@ -400,40 +2211,66 @@ class File:
 
 
 class Function:
+    __slots__ = (
+        "file",
+        "name",
+        "type",
+        "caller_ids",
+        "start_line",
+        "end_line",
+        "comment_lines",
+        "call_other_same",
+        "deprecated",
+    )
+
     ignored_func_names = []
 
     def __init__(self, file, type, name, start_line):
         self.file = file
-        if name.startswith("scope"):
+        if name.startswith("scope") and len(name) > 5:
             self.name = name[5].lower() + name[6:]
         else:
             self.name = name
         self.type = type
-        self.callers = []
+        self.caller_ids = array("i")
         self.start_line = start_line
         self.end_line = None
         self.comment_lines = 0
         self.call_other_same = False
         self.deprecated = False
 
-    def load(self):
-        if self.file.lines[self.start_line].strip().endswith(";"):
-            self.end_line = self.start_line
-        else:
-            state = 0
-            found = False
-            name_count = 0
-            for i, line in enumerate(self.file.lines[self.start_line :]):
-                state += line.count("{") - line.count("}")
-                found = found or line.count("{") > 0
-                name_count += line.lower().count(self.name.lower())
-                if state == 0 and found:
-                    self.end_line = self.start_line + i
-                    break
-            self.call_other_same = name_count > 1
-            self.start_line, self.comment_lines, self.deprecated = backward_comment(
-                self.file.lines, self.start_line
-            )
+    def dump(self):
+        return (
+            self.type,
+            self.name,
+            self.start_line,
+            self.end_line,
+            self.comment_lines,
+            self.call_other_same,
+            self.deprecated,
+        )
+
+    @classmethod
+    def restore(cls, file, data):
+        func = cls.__new__(cls)
+        func.file = file
+        func.caller_ids = array("i")
+        (
+            func.type,
+            func.name,
+            func.start_line,
+            func.end_line,
+            func.comment_lines,
+            func.call_other_same,
+            func.deprecated,
+        ) = data
+        func.type = sys.intern(func.type)
+        func.name = sys.intern(func.name)
+        return func
+
+    @property
+    def callers(self):
+        return [self.file.db.files[i] for i in self.caller_ids]
 
     @property
     def is_used(self):
@@ -443,12 +2280,10 @@ class Function:
             return False
         if self.file.reflexive_call:
             return True
-        if len(self.callers) == 0:
+        if len(self.caller_ids) == 0:
             return False
-        for caller in self.callers:
-            if caller.is_used:
-                return True
-        return False
+        files = self.file.db.files
+        return any(files[i].is_used for i in self.caller_ids)
 
     @property
     def lines(self):
@@ -457,21 +2292,43 @@ class Function:
     def __repr__(self):
         infos = [colorize(f"{self.lines} lines")]
         if self.is_used:
-            if len(self.callers) == 0:
+            if len(self.caller_ids) == 0:
                 infos += [colorize(f"reflexive")]
             else:
-                infos += [colorize(f"{len(self.callers)} callers")]
-        elif len(self.callers) > 0:
-            infos += [colorize(f"{len(self.callers)} unused callers")]
+                infos += [colorize(f"{len(self.caller_ids)} callers")]
+        elif len(self.caller_ids) > 0:
+            infos += [colorize(f"{len(self.caller_ids)} unused callers")]
         else:
             infos += [colorize(f"unused")]
         return colorize(f"{self.type} function {self.name} ({', '.join(infos)})")
 
 
+def intern(text):
+    return None if text is None else sys.intern(text)
+
+
+def unused_counts(db):
+    """-> the invalid roots, unused files and unused functions counts"""
+    unused = len(db.unused) + len(db.unreached)
+    counts = f"{len(db.invalid_roots)} invalid roots for {unused} unused files"
+    if db.imports_only:
+        return f"{counts} (functions not analysed with imports only)"
+    functions = f"{len(db.unused_func)} unused functions ({db.unused_func_lines} lines)"
+    return f"{counts} and {functions}"
+
+
 def time_print(t0, message):
     print(f"({1000*(time()-t0):.1f}ms) {message}")
 
 
+def peak_memory():
+    """Peak resident set size of this process in bytes, if known"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
 def print_branch(file, print_deprecated, level=0, found=[]):
     if file.deprecated and not print_deprecated:
         return
@@ -497,6 +2354,9 @@ def print_invalid_branches(db, print_deprecated):
 
 
 def print_unused_functions(db, print_deprecated):
+    if db.imports_only:
+        print("\n\n==== UNUSED FUNCTIONS: not analysed with imports only ====")
+        return
     funcs = [func for func in db.unused_func if print_deprecated or not func.deprecated]
     lines = sum([func.lines for func in funcs])
     print(f"\n\n==== {len(funcs)} UNUSED FUNCTIONS ({lines} lines) ====")
@@ -513,8 +2373,30 @@ def print_unused_functions(db, print_deprecated):
             print()
 
 
+def print_differences(db, full):
+    """Where the verdicts of an imports only scan differ from a full one"""
+    unused = {file.full_classname for file in db.unused}
+    full_unused = {file.full_classname for file in full.unused}
+    names = db.classes.keys() & full.classes.keys()
+    only_imports = sorted(names & (unused - full_unused))
+    only_full = sorted(names & (full_unused - unused))
+    same = len(names) - len(only_imports) - len(only_full)
+    print(
+        f"\n\n==== IMPORTS ONLY VS FULL: {same}/{len(names)} same verdicts ({same / max(1, len(names)):.1%}) ===="
+    )
+    print(f"{len(only_imports)} unused with imports only:")
+    for name in only_imports:
+        print(" ∟", colorize_namespace(name))
+    print(f"{len(only_full)} unused with the full scan only:")
+    for name in only_full:
+        print(" ∟", colorize_namespace(name))
+
+
 def print_specific(db, names):
-    print("\n\n==== SPECIFIC CLASSES ====")
+    if db.imports_only:
+        print("\n\n==== SPECIFIC CLASSES (functions not analysed) ====")
+    else:
+        print("\n\n==== SPECIFIC CLASSES ====")
     for name in names:
         if name not in db.classes:
             print("not found:", name)
@@ -522,7 +2404,7 @@ def print_specific(db, names):
         file = db.classes[name]
         print(file)
         func_callers = []
-        for func in file.functions:
+        for func in [] if db.imports_only else file.functions:
             print(" ∟", func)
             if len(func.callers) < 5:
                 for caller in func.callers:
@@ -545,16 +2427,92 @@ def print_specific(db, names):
         print()
 
 
-def read_config_list(config, section, option):
-    val = config.get(section, option)
+def branch_records(file, print_deprecated, root, level=0, found=None):
+    """Same tree as print_branch, one record per class"""
+    if file.deprecated and not print_deprecated:
+        return
+    found.add(file)
+    yield {"report": "invalid_branch", **describe(file), "root": root, "level": level}
+    for called in file.called:
+        if not called.is_used and called not in found:
+            yield from branch_records(called, print_deprecated, root, level + 1, found)
+
+
+def report_records(db, print_deprecated, invalid, functions, specific):
+    """Yield the reports as JSON records, while they are computed"""
+    yield {
+        "report": "summary",
+        "classes": len(db.classes),
+        "unused_files": len(db.unused) + len(db.unreached),
+        "invalid_roots": len(db.invalid_roots),
+        "unused_functions": None if db.imports_only else len(db.unused_func),
+        "unused_function_lines": None if db.imports_only else db.unused_func_lines,
+    }
+    if invalid:
+        for name in File.ignored:
+            yield {"report": "ignored", "class": name}
+        roots = db.invalid_roots if print_deprecated else db.invalid_roots_deprecated
+        found = set()
+        for file in roots:
+            yield from branch_records(
+                file, print_deprecated, file.full_classname, found=found
+            )
+    if functions and not db.imports_only:
+        for file in db.used:
+            for func in file.get_unused_functions():
+                if print_deprecated or not func.deprecated:
+                    yield {
+                        "report": "unused_function",
+                        "class": file.full_classname,
+                        "file": file.filename,
+                        **describe_function(func),
+                    }
+    for name in specific:
+        if name not in db.classes:
+            yield {"report": "specific", "class": name, "error": "not found"}
+            continue
+        file = db.classes[name]
+        yield {
+            "report": "specific",
+            **describe(file),
+            "functions": [
+                describe_function(func)
+                for func in ([] if db.imports_only else file.functions)
+            ],
+            "callers": [describe(caller) for caller in file.callers],
+        }
+
+
+def write_records(records, filename, format):
+    """Stream `records` to a buffered file, one JSON object per line with
+    the ndjson `format`, or as one JSON array -> number of records"""
+    count = 0
+    with open(filename, mode="w", buffering=2**16) as f:
+        if format == "json":
+            f.write("[")
+        for record in records:
+            if format == "json":
+                f.write(",\n" if count else "\n")
+                f.write(json.dumps(record))
+            else:
+                f.write(json.dumps(record) + "\n")
+            count += 1
+        if format == "json":
+            f.write("\n]\n")
+    return count
+
+
+def read_config_list(config, section, option, **kwargs):
+    val = config.get(section, option, **kwargs)
     return [v.strip() for v in val.splitlines() if len(v.strip()) > 0]
 
 
 def write_output(db, filename):
     t0 = time()
+    lines = [file.filename for file in db.unused] + db.unreached
     with open(filename, mode="w") as f:
-        f.write("\n".join([file.filename for file in db.unused]))
-    time_print(t0, f"wrote {len(db.unused)} lines in {filename}")
+        f.write("\n".join(lines))
+    time_print(t0, f"wrote {len(lines)} lines in {filename}")
 
 
 def remove_file(file, level=0, to_delete=[], force=False):
@@ -606,7 +2564,140 @@ def remove_files(db):
     time_print(t0, f"removed {len(to_delete)} files")
 
 
-def remove_func(db):
+def plan_deletions(db, print_deprecated):
+    """-> [(file, root)]: the invalid roots, then every unused class whose
+    callers are all planned, with the root which freed it. Each class keeps
+    a count of its callers left, so the closure is one pass over the graph.
+    Without `print_deprecated`, deprecated classes are kept and do not keep
+    their callees."""
+    roots = db.invalid_roots if print_deprecated else db.invalid_roots_deprecated
+    planned = set(roots)
+    left = {}
+    plan = []
+    for root in roots:
+        queue = [root]
+        for file in queue:
+            plan += [(file, root)]
+            for called in file.called:
+                if called.is_used or called in planned:
+                    continue
+                if called.deprecated and not print_deprecated:
+                    continue
+                if called not in left:
+                    left[called] = len(
+                        {
+                            caller
+                            for caller in called.callers
+                            if print_deprecated or not caller.deprecated
+                        }
+                    )
+                left[called] -= 1
+                if left[called] == 0:
+                    planned.add(called)
+                    queue += [called]
+    return plan
+
+
+def write_plan(plan, filename):
+    """One filename per line, under a comment naming their root"""
+    t0 = time()
+    lines = []
+    for file, root in plan:
+        if file is root:
+            lines += [f"# {root.full_classname}"]
+        lines += [file.filename]
+    with open(filename, mode="w") as f:
+        f.write("\n".join(lines) + "\n")
+    time_print(
+        t0, f"planned {len(plan)} files to delete in {filename}, review then apply it"
+    )
+
+
+def apply_plan(filename):
+    """Delete the files listed in a plan written by write_plan"""
+    t0 = time()
+    with open(filename) as f:
+        filenames = [line.strip() for line in f]
+    deleted = 0
+    missing = 0
+    for name in filenames:
+        if not name or name.startswith("#"):
+            continue
+        try:
+            os.unlink(name)
+            deleted += 1
+        except FileNotFoundError:
+            missing += 1
+    time_print(t0, f"deleted {deleted} files from {filename} ({missing} missing)")
+
+
+def cut_lines(lines, spans):
+    """-> `lines` without the (start, end) inclusive `spans`, in one pass"""
+    kept = []
+    pos = 0
+    for start, end in sorted(spans):
+        kept += lines[pos:start]
+        pos = max(pos, end + 1)
+    return kept + lines[pos:]
+
+
+def write_atomic(filename, content):
+    """Write `content` bytes through a temporary file renamed over
+    `filename`, so it is never left half-written"""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(fd, mode="wb") as f:
+            f.write(content)
+        os.chmod(tmp, os.stat(filename).st_mode & 0o7777)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def split_lines(content):
+    """-> lines of `content` bytes with their b"\n", split on b"\n" only"""
+    lines = [line + b"\n" for line in content.split(b"\n")]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+
+def patch_base(root_path):
+    """-> directory the paths of a patch are relative to: the git toplevel of
+    `root_path`, else its parent"""
+    try:
+        return git_toplevel(root_path)
+    except (OSError, subprocess.CalledProcessError):
+        return os.path.dirname(root_path)
+
+
+def unified_patch(filename, base, old, new):
+    """-> unified diff of `filename` from `old` to `new` bytes, for patch -p1
+    from the `base` directory"""
+    path = os.path.relpath(filename, base).replace(os.sep, "/").encode()
+    lines = []
+    for line in difflib.diff_bytes(
+        difflib.unified_diff,
+        split_lines(old),
+        split_lines(new),
+        b"a/" + path,
+        b"b/" + path,
+    ):
+        if not line.endswith(b"\n"):
+            line += b"\n\\ No newline at end of file\n"
+        lines += [line]
+    return b"".join(lines)
+
+
+def remove_func(db, patch=None):
+    """Delete the chosen functions, all the spans of a file at once, and
+    rewrite the files atomically on a thread pool. With `patch`, the tree
+    is left untouched and the changes are written there as one unified
+    diff."""
+    if db.imports_only:
+        print("\n\n==== REMOVING UNUSED FUNCTIONS: refused with imports only ====")
+        print("functions are not analysed, every method would look unused")
+        return
     print("\n\n==== REMOVING UNUSED FUNCTIONS ====")
     to_remove = []
     stop = False
@@ -638,35 +2729,263 @@ def remove_func(db):
                 stop = True
                 to_remove = []
                 break
-    to_rewrite = []
+    spans = {}
     for func in to_remove:
-        file = func.file
-        file.lines = file.lines[: func.start_line] + file.lines[func.end_line + 1 :]
-        if file not in to_rewrite:
-            to_rewrite += [file]
+        spans.setdefault(func.file, []).append((func.start_line, func.end_line))
+    base = patch_base(db.root_path) if patch is not None else None
+
+    def rewrite(file):
+        old = file.read()
+        new = b"\n".join(cut_lines(old.split(b"\n"), spans[file]))
+        if patch is not None:
+            return unified_patch(file.filename, base, old, new)
+        write_atomic(file.filename, new)
+
+    with ThreadPoolExecutor(db.workers) as pool:
+        results = list(pool.map(rewrite, spans))
     print(f"removed {len(to_remove)} functions")
-    for file in to_rewrite:
-        with open(file.filename, mode="w") as f:
-            f.write("\n".join(file.lines))
-    print(f"rewrote {len(to_rewrite)} files")
+    if patch is not None:
+        with open(patch, mode="wb") as f:
+            f.write(b"".join(results))
+        print(f"wrote the changes of {len(spans)} files in {patch}")
+        print(f"apply them with patch -p1 from {base}")
+    else:
+        print(f"rewrote {len(spans)} files")
 
 
-def main():
-    if not os.path.exists("config.ini"):
-        print("config.ini not found")
-        exit(1)
-        return
+def snapshot(db):
+    return {
+        "unused": {file.full_classname for file in db.unused},
+        "invalid root": {file.full_classname for file in db.invalid_roots},
+        "unused function": {
+            f"{func.file.full_classname}::{func.name}" for func in db.unused_func
+        },
+    }
 
-    config = ConfigParser()
-    config.read("config.ini")
 
-    config.getlist = lambda section, option: read_config_list(config, section, option)
+def print_changes(before, after):
+    for kind in after:
+        for name in sorted(after[kind] - before[kind]):
+            print(" +", colorize(kind), colorize_namespace(name))
+        for name in sorted(before[kind] - after[kind]):
+            print(" -", colorize(kind), colorize_namespace(name))
 
-    db = DB(config.get("input", "root_path"), config.getlist("input", "entrypoints"))
 
-    File.ignored = config.getlist("input", "ignored")
-    File.ignored_func = File.ignored + config.getlist("input", "ignored_func")
-    Function.ignored_func_names = config.getlist("input", "ignored_func_names")
+def git(path, *args):
+    """-> stdout of a local git command run in `path`"""
+    return subprocess.run(
+        ["git", "-C", path, *args], check=True, capture_output=True
+    ).stdout
+
+
+def git_toplevel(path):
+    return os.path.realpath(decode(git(path, "rev-parse", "--show-toplevel")).strip())
+
+
+def git_changes(db, ref):
+    """-> (commit of `ref`, files loaded by `db` that differ between that
+    commit and the working tree, untracked ones included)"""
+    top = git_toplevel(db.root_path)
+    commit = decode(git(top, "rev-parse", "--verify", f"{ref}^{{commit}}")).strip()
+    names = git(top, "diff", "--name-only", "--no-renames", "-z", commit)
+    names += git(top, "ls-files", "--others", "--exclude-standard", "--full-name", "-z")
+    filenames = {os.path.join(top, decode(name)) for name in names.split(b"\0") if name}
+    return commit, sorted(filter(db.tracks, filenames))
+
+
+def git_contents(db, commit, filenames):
+    """-> {filename: content at `commit`}, b"" for the files it has not"""
+    top = git_toplevel(db.root_path)
+    contents = {}
+    for filename in filenames:
+        try:
+            contents[filename] = git(
+                top, "show", f"{commit}:{os.path.relpath(filename, top)}"
+            )
+        except subprocess.CalledProcessError:
+            contents[filename] = b""
+    return contents
+
+
+def poll(db, stamps):
+    """Update `db` with the files changed since `stamps` -> new stamps"""
+    current = db.stamps()
+    changed = sorted(
+        filename
+        for filename in stamps.keys() | current.keys()
+        if stamps.get(filename) != current.get(filename)
+    )
+    if changed:
+        t0 = time()
+        before = snapshot(db)
+        db.update(changed)
+        for filename in changed:
+            print(colorize(os.path.relpath(filename, db.root_path)))
+        print_changes(before, snapshot(db))
+        time_print(
+            t0,
+            f"updated {len(changed)} files: {unused_counts(db)}",
+        )
+    return current
+
+
+def watch(db, interval):
+    print(f"\n\n==== WATCHING {colorize_namespace(db.root_path)} ====")
+    stamps = db.stamps()
+    try:
+        while True:
+            sleep(interval)
+            stamps = poll(db, stamps)
+    except KeyboardInterrupt:
+        pass
+
+
+def describe(file):
+    return {
+        "class": file.full_classname if file.is_class else None,
+        "type": file.type if file.is_class else None,
+        "file": file.filename,
+        "used": file.is_used,
+        "deprecated": file.deprecated,
+    }
+
+
+def describe_function(func):
+    return {
+        "name": func.name,
+        "type": func.type,
+        "lines": func.lines,
+        "used": func.is_used,
+        "deprecated": func.deprecated,
+        "callers": [caller.filename for caller in func.callers],
+    }
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """JSON answers about the loaded DB, one class per query:
+
+    /callers, /called, /functions, /branch and /why ?class=App\\...
+    """
+
+    db = None
+
+    def do_GET(self):
+        t0 = time()
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        name = query.get("class", [None])[0]
+        route = getattr(self, "query_" + url.path.strip("/"), None)
+        if route is None:
+            self.respond(404, {"error": f"unknown query: {url.path}"})
+        elif name is None:
+            self.respond(400, {"error": "missing class parameter"})
+        elif name not in self.db.classes:
+            self.respond(404, {"error": f"not found: {name}"})
+        else:
+            self.respond(200, route(self.db.classes[name]))
+        time_print(t0, f"{self.command} {self.path}")
+
+    def respond(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+    def query_callers(self, file):
+        return dict(describe(file), callers=[describe(f) for f in file.callers])
+
+    def query_called(self, file):
+        return dict(describe(file), called=[describe(f) for f in file.called])
+
+    def query_functions(self, file):
+        if self.db.imports_only:
+            return dict(
+                describe(file),
+                functions=[func.name for func in file.functions],
+                error="functions are not analysed with imports only",
+            )
+        return dict(
+            describe(file),
+            functions=[describe_function(func) for func in file.functions],
+            unused=[func.name for func in file.get_unused_functions()],
+        )
+
+    def query_branch(self, file, found=None):
+        """Same tree as print_branch: unused classes called from `file`"""
+        found = set() if found is None else found
+        found.add(file)
+        branch = []
+        for called in file.called:
+            if not called.is_used and called not in found:
+                branch += [self.query_branch(called, found)]
+        return dict(describe(file), branch=branch)
+
+    def query_why(self, file):
+        """Path from a root of the used classes to `file`"""
+        path = []
+        if file.is_used:
+            path = [file]
+            while self.db.reached_by[path[0].id] != -1:
+                path.insert(0, self.db.files[self.db.reached_by[path[0].id]])
+        reason = None
+        if path:
+            root = path[0]
+            if root.is_entrypoint:
+                reason = "entrypoint"
+            elif not root.is_class:
+                reason = "not a class"
+            else:
+                reason = "ignored"
+        return dict(describe(file), reason=reason, path=[describe(f) for f in path])
+
+
+def serve(db, host, port, interval=None):
+    """Answer queries until interrupted, and poll for changes every
+    `interval` seconds if given"""
+    QueryHandler.db = db
+    server = HTTPServer((host, port), QueryHandler)
+    server.timeout = interval
+    print(f"\n\n==== SERVING http://{host}:{server.server_port} ====")
+    stamps = db.stamps() if interval is not None else None
+    next_poll = time() + (interval or 0)
+    try:
+        while True:
+            server.handle_request()
+            if stamps is not None and time() >= next_poll:
+                stamps = poll(db, stamps)
+                next_poll = time() + interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def open_cache(config):
+    if config.get("cache", "path", fallback=None):
+        return Cache(
+            config.get("cache", "path"),
+            config.getboolean("cache", "hash", fallback=False),
+        )
+    return None
+
+
+def scan(config, targets=None, imports_only=False):
+    db = DB(
+        config.get("input", "root_path"),
+        config.getlist("input", "entrypoints"),
+        config.getint("input", "workers", fallback=1),
+        open_cache(config),
+        read_config_list(config, "input", "exclude", fallback=""),
+        config.get("input", "composer", fallback="") or None,
+        config.getint("input", "scan_workers", fallback=None),
+        imports_only,
+        config.getboolean("input", "call_sites", fallback=False),
+    )
 
     t0 = time()
     db.init()
@@ -676,34 +2995,374 @@ def main():
 
     t0 = time()
     db.load()
-    time_print(t0, f"loaded {len(db.classes)} classes")
+    infos = []
+    if db.workers > 1:
+        infos += [f"{db.workers} workers"]
+    if db.cache is not None:
+        infos += [f"{db.cache.hits} cached"]
+    if db.composer is not None:
+        infos += [f"{len(db.unreached)} unreached files"]
+    infos = f" ({', '.join(infos)})" if infos else ""
+    time_print(t0, f"loaded {len(db.classes)} classes{infos}")
 
     t0 = time()
+    if targets is not None:
+        analysed = db.scan_targets(targets)
+        time_print(t0, f"scanned {analysed} classes for {len(targets)} classes to scan")
+        return db
     db.scan()
+    scanned = "imports (approximate)" if imports_only else "classes"
+    time_print(
+        t0,
+        f"scanned {scanned} and found {unused_counts(db)}",
+    )
+    return db
+
+
+def diff(config, ref, imports_only=False):
+    """Scan the files changed since the git `ref` over a baseline DB of that
+    commit, and print what changed -> the DB of the working tree.
+
+    Without a stored baseline for the commit, the working tree is scanned
+    (through the cache) and the changed files reverted to their content at
+    the commit; the baseline is then stored for the next runs.
+    """
+    db = DB(
+        config.get("input", "root_path"),
+        config.getlist("input", "entrypoints"),
+        exclude=read_config_list(config, "input", "exclude", fallback=""),
+    )
+    try:
+        commit, changed = git_changes(db, ref)
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = decode(getattr(e, "stderr", b"") or b"").strip()
+        print(f"cannot diff against {ref}: {stderr or e}")
+        exit(1)
+
+    baseline = Baseline(config.get("diff", "baseline", fallback="") or None)
+    fingerprint = Baseline.fingerprint(config, imports_only)
+    t0 = time()
+    db = baseline.load(commit, db.root_path, fingerprint) if baseline.path else None
+    if db is not None and db.imports_only == imports_only:
+        db.cache = open_cache(config)
+        if db.cache is not None:
+            db.cache.load()
+        time_print(t0, f"read baseline of {commit[:12]} from {baseline.path}")
+    else:
+        db = scan(config, imports_only=imports_only)
+        t0 = time()
+        with profiler.phase("baseline"):
+            db.update(changed, git_contents(db, commit, changed))
+        time_print(t0, f"reverted {len(changed)} files to {commit[:12]}")
+        if baseline.path:
+            t0 = time()
+            baseline.save(db, commit, fingerprint)
+            time_print(t0, f"wrote baseline in {baseline.path}")
+
+    t0 = time()
+    before = snapshot(db)
+    db.update(changed)
+    print(f"\n\n==== CHANGES SINCE {ref} ====")
+    for filename in changed:
+        print(colorize(os.path.relpath(filename, db.root_path)))
+    print_changes(before, snapshot(db))
     time_print(
         t0,
-        f"scanned classes and found {len(db.invalid_roots)} invalid roots for {len(db.unused)} unused files and {len(db.unused_func)} unused functions ({db.unused_func_lines} lines)",
+        f"updated {len(changed)} files: {unused_counts(db)}",
+    )
+    return db
+
+
+def configure_colors(config):
+    """Plain text with `[output] color = false`, or whatever it says with a
+    non-empty NO_COLOR environment variable"""
+    global plain
+    plain = bool(os.environ.get("NO_COLOR")) or not config.getboolean(
+        "output", "color", fallback=True
     )
 
+
+def run(config):
+    configure_colors(config)
+    report_format = config.get("output", "report_format", fallback="text")
+    report_file = config.get("output", "report_file", fallback="report.json")
+    if report_format not in ("text", "ndjson", "json"):
+        print(f"unknown report_format: {report_format} (text, ndjson or json)")
+        exit(1)
+
+    File.ignored = config.getlist("input", "ignored")
+    File.ignored_func = File.ignored + config.getlist("input", "ignored_func")
+    Function.ignored_func_names = config.getlist("input", "ignored_func_names")
+
+    if config.get("output", "apply_plan", fallback=""):
+        apply_plan(config.get("output", "apply_plan"))
+        return
+
+    snapshot = config.get("snapshot", "input", fallback="")
+    targeted = config.getboolean("output", "targeted", fallback=False)
+    if targeted and not snapshot:
+        db = scan(config, config.getlist("output", "to_scan"))
+        with profiler.phase("print_specific"):
+            print_specific(db, config.getlist("output", "to_scan"))
+        return db
+    if snapshot:
+        t0 = time()
+        with profiler.phase("snapshot"):
+            db = Snapshot.read(snapshot)
+        time_print(
+            t0,
+            f"read {len(db.classes)} classes from {snapshot} "
+            f"and found {unused_counts(db)}",
+        )
+    else:
+        imports_only = config.getboolean("input", "imports_only", fallback=False)
+        ref = config.get("diff", "ref", fallback="")
+        if ref:
+            db = diff(config, ref, imports_only)
+        else:
+            db = scan(config, imports_only=imports_only)
+        if config.get("snapshot", "output", fallback=""):
+            t0 = time()
+            Snapshot.write(db, config.get("snapshot", "output"))
+            time_print(t0, f"wrote snapshot in {config.get('snapshot', 'output')}")
+
+    peak = peak_memory()
+    if peak is not None:
+        print(f"peak memory {peak / 2**20:.1f}MB")
+
     if config.get("output", "output_file"):
-        write_output(db, config.get("output", "output_file"))
+        with profiler.phase("write_output"):
+            write_output(db, config.get("output", "output_file"))
 
     print_deprecated = config.getboolean("output", "print_deprecated")
 
-    if config.getboolean("output", "print_invalid"):
-        print_invalid_branches(db, print_deprecated)
+    if report_format != "text":
+        t0 = time()
+        with profiler.phase("write_report"):
+            count = write_records(
+                report_records(
+                    db,
+                    print_deprecated,
+                    config.getboolean("output", "print_invalid"),
+                    config.getboolean("output", "print_functions"),
+                    (
+                        config.getlist("output", "to_scan")
+                        if config.getboolean("output", "print_specific")
+                        else []
+                    ),
+                ),
+                report_file,
+                report_format,
+            )
+        time_print(t0, f"wrote {count} records in {report_file}")
+
+    if report_format == "text" and config.getboolean("output", "print_invalid"):
+        with profiler.phase("print_invalid_branches"):
+            print_invalid_branches(db, print_deprecated)
+
+    if report_format == "text" and config.getboolean("output", "print_functions"):
+        with profiler.phase("print_unused_functions"):
+            print_unused_functions(db, print_deprecated)
 
-    if config.getboolean("output", "print_functions"):
-        print_unused_functions(db, print_deprecated)
+    if report_format == "text" and config.getboolean("output", "print_specific"):
+        with profiler.phase("print_specific"):
+            print_specific(db, config.getlist("output", "to_scan"))
 
-    if config.getboolean("output", "print_specific"):
-        print_specific(db, config.getlist("output", "to_scan"))
+    if db.imports_only and config.getboolean("output", "compare_full", fallback=False):
+        print("\n\n==== FULL SCAN ====")
+        print_differences(db, scan(config))
+
+    if config.get("output", "delete_plan", fallback=""):
+        with profiler.phase("delete_plan"):
+            write_plan(
+                plan_deletions(db, print_deprecated),
+                config.get("output", "delete_plan"),
+            )
 
     if config.getboolean("output", "remove_files"):
         remove_files(db)
 
     if config.getboolean("output", "remove_func"):
-        remove_func(db)
+        remove_func(db, config.get("output", "remove_func_patch", fallback="") or None)
+
+    interval = None
+    # a snapshot has no parsed files to update
+    if config.getboolean("watch", "enabled", fallback=False) and not snapshot:
+        interval = config.getfloat("watch", "interval", fallback=1.0)
+
+    if config.getboolean("server", "enabled", fallback=False):
+        serve(
+            db,
+            config.get("server", "host", fallback="127.0.0.1"),
+            config.getint("server", "port", fallback=8765),
+            interval,
+        )
+    elif interval is not None:
+        watch(db, interval)
+    return db
+
+
+def read_config(filename):
+    config = ConfigParser()
+    config.read(filename)
+    config.getlist = lambda section, option: read_config_list(config, section, option)
+    return config
+
+
+# options which would prompt, never return or compete for the CPUs in a batch
+BATCH_OVERRIDES = [
+    ("input", "workers", "1"),
+    ("input", "scan_workers", "1"),
+    ("output", "remove_files", "false"),
+    ("output", "remove_func", "false"),
+    ("output", "apply_plan", ""),
+    ("watch", "enabled", "false"),
+    ("server", "enabled", "false"),
+]
+
+
+def run_project(filename, cache_path=None, profiling=False):
+    """Run the config `filename` from its directory, printing in a .log file
+    next to it -> (summary, parse cache entries added, dumped profiler or
+    None). Phase times are summarized when `profiling` or the [profile] of
+    the project enables it."""
+    os.chdir(os.path.dirname(filename))
+    config = read_config(filename)
+    for section, option, value in BATCH_OVERRIDES:
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, option, value)
+    if cache_path is not None:
+        if not config.has_section("cache"):
+            config.add_section("cache")
+        config.set("cache", "path", cache_path)
+    profiler.reset()
+    profiler.configure(
+        profiling or config.getboolean("profile", "enabled", fallback=False),
+        config.getint("profile", "top", fallback=20),
+    )
+
+    summary = {"config": filename, "log": os.path.splitext(filename)[0] + ".log"}
+    db = None
+    t0 = time()
+    try:
+        with open(summary["log"], mode="w") as f, redirect_stdout(f):
+            db = run(config)
+    except (Exception, SystemExit) as e:
+        summary["error"] = f"{type(e).__name__}: {e}"
+    summary["time_ms"] = round(1000 * (time() - t0), 3)
+    profile = None
+    if profiler.enabled:
+        summary["phases"] = {
+            key: round(1000 * phase["time"], 3)
+            for key, phase in profiler.phases.items()
+            if "/" not in key
+        }
+        profile = profiler.dump()
+    if db is None:
+        return summary, {}, profile
+    summary.update(
+        root_path=db.root_path,
+        classes=len(db.classes),
+        unused_files=len(db.unused) + len(db.unreached),
+        invalid_roots=len(db.invalid_roots),
+        unused_functions=None if db.imports_only else len(db.unused_func),
+        unused_function_lines=None if db.imports_only else db.unused_func_lines,
+    )
+    return summary, db.cache.added if db.cache is not None else {}, profile
+
+
+def batch(config):
+    """Run the projects of several config files concurrently, one process
+    each, and summarize them. A shared cache is loaded once and inherited by
+    the workers; the entries they add are saved once at the end. When
+    profiling, the profiles of the projects are added to the one of the
+    batch."""
+    configure_colors(config)
+    filenames = [os.path.abspath(name) for name in config.getlist("batch", "configs")]
+    cache_path = config.get("batch", "cache", fallback="") or None
+    cache = None
+    if cache_path is not None:
+        cache_path = os.path.abspath(cache_path)
+        cache = Cache(cache_path)
+        cache.load()
+    workers = config.getint("batch", "workers", fallback=0) or os.cpu_count() or 1
+
+    t0 = time()
+    print(f"==== {len(filenames)} PROJECTS ====")
+    summaries = []
+    with ProcessPoolExecutor(
+        max(1, min(workers, len(filenames))),
+        initializer=Cache.init_worker,
+        initargs=(cache.entries if cache is not None else None,),
+    ) as pool:
+        for summary, added, profile in pool.map(
+            run_project,
+            filenames,
+            [cache_path] * len(filenames),
+            [profiler.enabled] * len(filenames),
+        ):
+            summaries += [summary]
+            if cache is not None:
+                cache.merge(added)
+            if profile is not None and profiler.enabled:
+                profiler.add(profile)
+            if "error" in summary:
+                result = summary["error"]
+            else:
+                result = (
+                    f"{summary['classes']} classes, "
+                    f"{summary['unused_files']} unused files"
+                )
+                if summary["unused_functions"] is not None:
+                    result += (
+                        f", {summary['unused_functions']} unused functions "
+                        f"({summary['unused_function_lines']} lines)"
+                    )
+            name = colorize(os.path.relpath(summary["config"]))
+            print(f"({summary['time_ms']:.1f}ms) {name}: {result}")
+    if cache is not None:
+        cache.save()
+    time_print(t0, f"analysed {len(filenames)} projects")
+
+    output = config.get("batch", "summary", fallback="")
+    if output:
+        with open(output, mode="w") as f:
+            json.dump(summaries, f, indent=2)
+        print(f"wrote summary in {output}")
+
+
+def main():
+    if not os.path.exists("config.ini"):
+        print("config.ini not found")
+        exit(1)
+        return
+
+    config = read_config("config.ini")
+
+    profiler.configure(
+        config.getboolean("profile", "enabled", fallback=False),
+        config.getint("profile", "top", fallback=20),
+    )
+    cprofile_file = config.get("profile", "cprofile", fallback="")
+    if cprofile_file:
+        stats = cProfile.Profile()
+        stats.enable()
+
+    if config.get("batch", "configs", fallback=""):
+        batch(config)
+    else:
+        run(config)
+
+    if cprofile_file:
+        stats.disable()
+        stats.dump_stats(cprofile_file)
+        print(f"wrote cProfile stats in {cprofile_file}")
+    if profiler.enabled:
+        report_file = config.get("profile", "report", fallback="profile.json")
+        profiler.write(report_file)
+        print(f"wrote profile report in {report_file}")
 
 
-main()
+if __name__ == "__main__":
+    main()